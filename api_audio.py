@@ -0,0 +1,112 @@
+from fastapi import APIRouter, Request, Query
+from fastapi.responses import JSONResponse, FileResponse, Response
+from functools import lru_cache
+import asyncio
+import hashlib
+import os
+import config
+import storage
+import transcode
+
+router = APIRouter()
+
+STATIC_DIR = config.STATIC_DIR
+
+# URL có ?v=<hash nội dung> trỏ tới đúng một phiên bản file nên được cache vĩnh viễn;
+# URL không có phiên bản (file có thể bị tạo lại, ví dụ sửa một dòng rồi tạo lại) phải xác thực lại bằng ETag.
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class AudioFileResponse(FileResponse):
+    # Chunk lớn hơn mặc định: ít lượt đọc/gửi hơn khi tua trong full.wav dài.
+    # Khi server hỗ trợ extension http.response.pathsend, FileResponse gửi cả file bằng đường dẫn (zero-copy).
+    chunk_size = 256 * 1024
+
+
+def is_safe_name(name):
+    return name not in ("", ".", "..") and "/" not in name and "\\" not in name
+
+
+@lru_cache(maxsize=4096)
+def _content_hash(path, mtime_ns, size):
+    # mtime_ns và size nằm trong key: file bị ghi đè sẽ được hash lại, entry cũ tự bị đẩy ra khỏi cache
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def content_etag(path, stat_result=None):
+    """
+    ETag mạnh theo hash nội dung file (dạng "…" có dấu nháy). Chỉ đọc file lần đầu cho mỗi phiên bản.
+    """
+    stat_result = stat_result or os.stat(path)
+    return f'"{_content_hash(path, stat_result.st_mtime_ns, stat_result.st_size)}"'
+
+
+async def audio_url(username, time_key, filename):
+    """
+    URL nghe thử có gắn phiên bản nội dung, trình duyệt cache vĩnh viễn và không phải tải lại khi phát lại.
+    """
+    etag = await asyncio.to_thread(content_etag, os.path.join(STATIC_DIR, username, time_key, filename))
+    version = etag.strip('"')
+    return f"audio/{username}/{time_key}/{filename}?v={version}"
+
+
+def etag_matches(if_none_match, etag):
+    """
+    So sánh yếu theo RFC 9110 cho If-None-Match: bỏ tiền tố W/ ở cả hai phía.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag.removeprefix("W/") in tags
+
+
+@router.api_route("/audio/{username}/{time_key}/{filename}", methods=["GET", "HEAD"])
+async def get_audio(
+    request: Request,
+    username: str,
+    time_key: str,
+    filename: str,
+    fmt: str | None = Query(None, alias="format"),
+    v: str | None = None
+):
+    """
+    Trả về file wav đã tạo hoặc bản nén của nó (flac/mp3/opus) theo header Accept hoặc ?format=.
+    Hỗ trợ ETag/If-None-Match (304), Range/If-Range để tua, và cache immutable cho URL có ?v=.
+    """
+    if not all(is_safe_name(name) for name in (username, time_key, filename)) or not filename.endswith(".wav"):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
+    if fmt is not None and fmt not in transcode.FORMATS:
+        return JSONResponse({"error": "Định dạng không hỗ trợ."}, status_code=400)
+
+    wav_path = os.path.join(STATIC_DIR, username, time_key, filename)
+    if not os.path.isfile(wav_path):
+        return JSONResponse({"error": "File không tồn tại."}, status_code=404)
+    # Đang được nghe: giữ session ở đầu LRU để không bị xóa khi ép quota
+    if storage.access_due(username, time_key):
+        await asyncio.to_thread(storage.touch_session, username, time_key)
+
+    fmt = transcode.negotiate(request.headers.get("accept"), fmt)
+    path = await transcode.get_variant(username, time_key, wav_path, fmt)
+    if path == wav_path:
+        fmt = "wav"
+
+    stat_result = await asyncio.to_thread(os.stat, path)
+    etag = await asyncio.to_thread(content_etag, path, stat_result)
+    cache_control = REVALIDATE_CACHE_CONTROL
+    if v is not None:
+        source_etag = etag if path == wav_path else await asyncio.to_thread(content_etag, wav_path)
+        # Phiên bản cũ (file đã bị tạo lại) không được cache vĩnh viễn vì nội dung trả về đã khác
+        if f'"{v}"' == source_etag:
+            cache_control = IMMUTABLE_CACHE_CONTROL
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    return AudioFileResponse(path, media_type=transcode.FORMATS[fmt][0], headers=headers, stat_result=stat_result)
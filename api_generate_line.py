@@ -1,54 +1,173 @@
-from voicepeak_wrapper.util import say_text_sync
+from voicepeak_wrapper.util import concat_wav
+from api_audio import audio_url, is_safe_name
 
 from fastapi import APIRouter, Request, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 import os
 import asyncio
+import codecs
+import json
 import glob
-import wave
-import struct
 import zipfile
-import tempfile
-from voicepeak_wrapper.voicepeak import Voicepeak
+import config
+import engine
+import history
+import ingest
+import profiling
+import storage
+import synthesis
+import transcode
 
 router = APIRouter()
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-STATIC_DIR = os.path.join(BASE_DIR, "static")
+STATIC_DIR = config.STATIC_DIR
 
-@router.post("/api/generate-line")
-async def generate_line(
-    request: Request,
-    username: str = Form(...),
-    voice: str = Form(...),
-    line: str = Form(...),
-    index: int = Form(...),
-    time_key: str = Form(...)
-):
-    if not username or not line.strip() or not time_key:
-        return JSONResponse({"error": "Thiếu thông tin."}, status_code=400)
+class LineStreamResponse(StreamingResponse):
+    """
+    StreamingResponse không chạy listen_for_disconnect: với ASGI spec < 2.4 tác vụ đó gọi receive() song song
+    và nuốt mất các chunk body mà generate_stream vẫn đang đọc. Ngắt kết nối được phát hiện qua request.stream().
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+
+
+async def render_line(client, username, time_key, voice, line, index):
+    """
+    Tạo NN.txt và NN.wav cho một dòng trong static/username/time_key. Kết quả có key error nếu lỗi.
+    """
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return {"error": "Đường dẫn không hợp lệ.", "index": index, "text": line}
     user_dir = os.path.join(STATIC_DIR, username, time_key)
     os.makedirs(user_dir, exist_ok=True)
     wav_path = os.path.join(user_dir, f"{index:02d}.wav")
     txt_path = os.path.join(user_dir, f"{index:02d}.txt")
     with open(txt_path, "w", encoding="utf-8") as f:
         f.write(line)
-    client = Voicepeak()
     try:
-        await asyncio.to_thread(say_text_sync, client, line, wav_path, voice)
+        await synthesis.render(client, line, voice, wav_path)
     except Exception as e:
         # Ghi lỗi ra file error.log như server.py
         error_log = os.path.join(user_dir, "error.log")
         with open(error_log, "a", encoding="utf-8") as err_file:
             err_file.write(f"Lỗi tạo voice cho dòng {index}: {line}\n{str(e)}\n")
-        return JSONResponse({"error": str(e)}, status_code=500)
-    return JSONResponse({
+        await asyncio.to_thread(storage.track_files, username, time_key, txt_path, wav_path, error_log)
+        return {"error": str(e), "index": index, "text": line}
+    with profiling.span("storage.track_files"):
+        await asyncio.to_thread(storage.track_files, username, time_key, txt_path, wav_path)
+    with profiling.span("history.record_line"):
+        await asyncio.to_thread(history.record_line, username, time_key, voice, index)
+    transcode.prewarm(username, time_key, wav_path)
+    return {
         "wav_url": f"static/{username}/{time_key}/{index:02d}.wav",
+        "audio_url": await audio_url(username, time_key, f"{index:02d}.wav"),
         "index": index,
         "text": line
-    })
+    }
+
+@router.post("/api/generate-line")
+@profiling.profiled("/api/generate-line")
+async def generate_line(
+    request: Request,
+    username: str = Form(...),
+    voice: str = Form(...),
+    line: str = Form(...),
+    index: int = Form(...),
+    time_key: str = Form(...)
+):
+    if not username or not line.strip() or not time_key:
+        return JSONResponse({"error": "Thiếu thông tin."}, status_code=400)
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
+    if not await asyncio.to_thread(storage.enforce_quota, username, time_key):
+        return JSONResponse({"error": "Đã vượt quá dung lượng lưu trữ cho phép."}, status_code=507)
+    client = engine.get_client(request)
+    result = await render_line(client, username, time_key, voice, line, index)
+    if "error" in result:
+        return JSONResponse({"error": result["error"]}, status_code=500)
+    return JSONResponse(result)
+
+@router.post("/api/draft")
+async def update_draft(
+    request: Request,
+    voice: str = Form(...),
+    text: str = Form("")
+):
+    """
+    Nhận bản nháp (gửi có debounce khi người dùng đang gõ) và tạo trước các dòng đã gõ xong ở độ ưu tiên thấp.
+    Dòng cuối chưa có xuống dòng được coi là đang gõ dở và bị bỏ qua. Chỉ dùng cho user đã đăng nhập.
+    """
+    username = request.session.get("username")
+    if not username:
+        return JSONResponse({"error": "Chưa đăng nhập."}, status_code=401)
+    completed = text.split("\n")[:-1]
+    lines = [line.strip() for line in completed if line.strip()]
+    lines = [line for line in lines if len(line) <= ingest.MAX_LINE_CHARS]
+    result = synthesis.drafts.update(engine.get_client(request), username, voice, lines)
+    return JSONResponse(result)
+
+@router.post("/api/generate-stream")
+async def generate_stream(
+    request: Request,
+    username: str,
+    voice: str,
+    time_key: str,
+    encoding: str | None = None
+):
+    """
+    Nhận cả script dưới dạng body thô (file txt) và tạo voice cho từng dòng ngay khi đọc được,
+    không chờ upload xong. Trả về NDJSON: mỗi dòng một kết quả giống /api/generate-line,
+    dòng cuối là {"done": true, "total_lines": n}. Chỉ ghi vào thư mục của user đang đăng nhập (admin: mọi user).
+    """
+    current = request.session.get("username")
+    if not current:
+        return JSONResponse({"error": "Chưa đăng nhập."}, status_code=401)
+    if username != current and not request.session.get("is_admin", False):
+        return JSONResponse({"error": "Không có quyền."}, status_code=403)
+    if not username or not time_key:
+        return JSONResponse({"error": "Thiếu thông tin."}, status_code=400)
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
+    if encoding is not None:
+        try:
+            codecs.lookup(encoding)
+        except LookupError:
+            return JSONResponse({"error": "Encoding không hợp lệ."}, status_code=400)
+    if not await asyncio.to_thread(storage.enforce_quota, username, time_key):
+        return JSONResponse({"error": "Đã vượt quá dung lượng lưu trữ cho phép."}, status_code=507)
+
+    # Hàng đợi có giới hạn: khi tạo voice chậm hơn upload thì ngừng đọc body, bộ nhớ không phụ thuộc kích thước file
+    queue = asyncio.Queue(maxsize=config.INGEST_QUEUE_LINES)
+
+    async def read_lines():
+        try:
+            async for line in ingest.iter_lines(request.stream(), encoding=encoding):
+                await queue.put(line)
+        except Exception:
+            await queue.put(None)
+            raise
+        await queue.put(None)
+
+    async def events():
+        reader = asyncio.create_task(read_lines())
+        client = engine.get_client(request)
+        index = 0
+        try:
+            while (line := await queue.get()) is not None:
+                result = await render_line(client, username, time_key, voice, line, index)
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+                index += 1
+            await reader
+            yield json.dumps({"done": True, "total_lines": index}) + "\n"
+        except Exception as e:
+            yield json.dumps({"done": True, "total_lines": index, "error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            reader.cancel()
+
+    return LineStreamResponse(events(), media_type="application/x-ndjson")
 
 @router.post("/api/merge-audio")
+@profiling.profiled("/api/merge-audio")
 async def merge_audio(
     request: Request,
     username: str = Form(...),
@@ -59,72 +178,43 @@ async def merge_audio(
     """
     if not username or not time_key:
         return JSONResponse({"error": "Thiếu thông tin."}, status_code=400)
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
     
     user_dir = os.path.join(STATIC_DIR, username, time_key)
     if not os.path.exists(user_dir):
         return JSONResponse({"error": "Thư mục không tồn tại."}, status_code=404)
     
     # Lấy danh sách file wav và txt theo thứ tự
-    wav_files = sorted(glob.glob(os.path.join(user_dir, "[0-9][0-9].wav")))
-    txt_files = sorted(glob.glob(os.path.join(user_dir, "[0-9][0-9].txt")))
+    wav_files = list_numbered_files(user_dir, "wav")
+    txt_files = list_numbered_files(user_dir, "txt")
     
     if not wav_files or not txt_files:
         return JSONResponse({"error": "Không tìm thấy file wav hoặc txt."}, status_code=404)
     
     try:
-        # Nối các file wav với khoảng nghỉ 0.5s
+        # Nối các file wav với khoảng nghỉ 0.5s, ghi thẳng ra full.wav
         pause_duration_ms = 500  # milliseconds
+        full_wav_path = os.path.join(user_dir, "full.wav")
+        line_count = min(len(wav_files), len(txt_files))
+        with profiling.span("merge.concat_wav", lines=line_count):
+            spans = await asyncio.to_thread(
+                profiling.traced("concat_wav", concat_wav), wav_files[:line_count], full_wav_path, pause_duration_ms
+            )
         
-        # Đọc thông tin từ file wav đầu tiên để lấy params
-        with wave.open(wav_files[0], 'rb') as first_wav:
-            params = first_wav.getparams()
-            sample_rate = params.framerate
-            sample_width = params.sampwidth
-            channels = params.nchannels
-        
-        # Tính số frames cho khoảng nghỉ 0.5s
-        pause_frames = int(sample_rate * pause_duration_ms / 1000)
-        pause_data = b'\x00' * (pause_frames * sample_width * channels)
-        
-        combined_frames = []
         srt_entries = []
-        current_time_ms = 0  # milliseconds
-        
-        for idx, (wav_file, txt_file) in enumerate(zip(wav_files, txt_files), start=1):
+        for idx, (txt_file, (start_time, end_time)) in enumerate(zip(txt_files, spans), start=1):
             # Đọc nội dung text
             with open(txt_file, "r", encoding="utf-8") as f:
                 text_content = f.read().strip()
             
-            # Đọc file wav
-            with wave.open(wav_file, 'rb') as wav:
-                frames = wav.readframes(wav.getnframes())
-                duration_ms = int((wav.getnframes() / sample_rate) * 1000)
-            
-            # Tạo entry cho SRT
-            start_time = current_time_ms
-            end_time = current_time_ms + duration_ms
-            
             srt_entries.append({
                 "index": idx,
                 "start": start_time,
                 "end": end_time,
                 "text": text_content
             })
-            
-            # Thêm audio frames
-            combined_frames.append(frames)
-            current_time_ms += duration_ms
-            
-            # Thêm khoảng nghỉ (trừ file cuối cùng)
-            if idx < len(wav_files):
-                combined_frames.append(pause_data)
-                current_time_ms += pause_duration_ms
-        
-        # Lưu file full.wav
-        full_wav_path = os.path.join(user_dir, "full.wav")
-        with wave.open(full_wav_path, 'wb') as output_wav:
-            output_wav.setparams(params)
-            output_wav.writeframes(b''.join(combined_frames))
+        current_time_ms = spans[-1][1]
         
         # Tạo file full.srt
         full_srt_path = os.path.join(user_dir, "full.srt")
@@ -137,9 +227,17 @@ async def merge_audio(
                 srt_file.write(f"{entry['index']}\n")
                 srt_file.write(f"{start_str} --> {end_str}\n")
                 srt_file.write(f"{entry['text']}\n\n")
+        with profiling.span("storage.track_files"):
+            await asyncio.to_thread(storage.track_files, username, time_key, full_wav_path, full_srt_path)
+        await asyncio.to_thread(
+            history.finish_session, username, time_key, history.STATUS_COMPLETED,
+            line_count=len(srt_entries), total_duration=current_time_ms / 1000
+        )
+        transcode.prewarm(username, time_key, full_wav_path)
         
         return JSONResponse({
             "full_wav_url": f"static/{username}/{time_key}/full.wav",
+            "full_audio_url": await audio_url(username, time_key, "full.wav"),
             "full_srt_url": f"static/{username}/{time_key}/full.srt",
             "total_lines": len(srt_entries),
             "total_duration_seconds": current_time_ms / 1000
@@ -149,6 +247,8 @@ async def merge_audio(
         error_log = os.path.join(user_dir, "error.log")
         with open(error_log, "a", encoding="utf-8") as err_file:
             err_file.write(f"Lỗi khi merge audio: {str(e)}\n")
+        await asyncio.to_thread(storage.track_files, username, time_key, error_log)
+        await asyncio.to_thread(history.finish_session, username, time_key, history.STATUS_FAILED)
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
@@ -163,6 +263,8 @@ async def download_zip(
     """
     if not username or not time_key:
         return JSONResponse({"error": "Thiếu thông tin."}, status_code=400)
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
     
     user_dir = os.path.join(STATIC_DIR, username, time_key)
     if not os.path.exists(user_dir):
@@ -171,17 +273,24 @@ async def download_zip(
     try:
         # Tạo file zip tạm
         zip_filename = f"{username}_{time_key.replace('.', '_').replace(':', '_')}.zip"
-        zip_path = os.path.join(tempfile.gettempdir(), zip_filename)
+        os.makedirs(config.ZIP_DIR, exist_ok=True)
+        zip_path = os.path.join(config.ZIP_DIR, zip_filename)
         
         # Tạo zip file
         with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # Duyệt qua tất cả file trong thư mục
             for root, dirs, files in os.walk(user_dir):
+                # Bỏ qua profile (chỉ dùng để chẩn đoán)
+                dirs[:] = [d for d in dirs if d != profiling.PROFILE_DIR_NAME]
                 for file in files:
+                    # Bỏ qua bản nén để nghe thử, chỉ đóng gói file gốc
+                    if os.path.splitext(file)[1] in transcode.VARIANT_EXTENSIONS:
+                        continue
                     file_path = os.path.join(root, file)
                     # Thêm file vào zip với đường dẫn tương đối
                     arcname = os.path.relpath(file_path, user_dir)
                     zipf.write(file_path, arcname)
+        await asyncio.to_thread(storage.touch_session, username, time_key)
         
         # Trả về file zip
         return FileResponse(
@@ -197,6 +306,15 @@ async def download_zip(
         return JSONResponse({"error": str(e)}, status_code=500)
 
 
+def list_numbered_files(user_dir, ext):
+    """
+    Lấy danh sách file dạng 00.ext, 01.ext, ..., 100.ext sắp xếp theo số thứ tự dòng
+    """
+    files = glob.glob(os.path.join(user_dir, f"[0-9][0-9]*.{ext}"))
+    files = [f for f in files if os.path.basename(f)[: -len(ext) - 1].isdigit()]
+    return sorted(files, key=lambda f: int(os.path.basename(f)[: -len(ext) - 1]))
+
+
 def format_srt_time(milliseconds):
     """
     Chuyển milliseconds thành format SRT: HH:MM:SS,mmm
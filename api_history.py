@@ -0,0 +1,52 @@
+from fastapi import APIRouter, Request, Query
+from fastapi.responses import JSONResponse
+import asyncio
+import history
+
+router = APIRouter()
+
+MAX_PAGE_SIZE = 100
+
+
+@router.get("/api/sessions")
+async def list_sessions(
+    request: Request,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    before: str | None = None,
+    status: str | None = None,
+    username: str | None = None
+):
+    """
+    Lịch sử các phiên tạo voice của user đang đăng nhập, mới nhất trước, đọc từ bảng sessions.
+    Trang tiếp theo: truyền next_cursor của trang trước vào ?before=. Admin có thể xem user khác qua ?username=
+    hoặc tất cả user qua ?username=*.
+    """
+    current = request.session.get("username")
+    if not current:
+        return JSONResponse({"error": "Chưa đăng nhập."}, status_code=401)
+    if username is None or username == current:
+        username = current
+    elif not request.session.get("is_admin", False):
+        return JSONResponse({"error": "Không có quyền."}, status_code=403)
+    elif username == "*":
+        username = None
+    try:
+        rows, next_cursor = await asyncio.to_thread(history.list_sessions, username, limit, before, status)
+    except ValueError:
+        return JSONResponse({"error": "Con trỏ phân trang không hợp lệ."}, status_code=400)
+    return JSONResponse({"sessions": rows, "next_cursor": next_cursor})
+
+
+@router.get("/api/sessions/{time_key}")
+async def get_session(request: Request, time_key: str, username: str | None = None):
+    current = request.session.get("username")
+    if not current:
+        return JSONResponse({"error": "Chưa đăng nhập."}, status_code=401)
+    if username is None:
+        username = current
+    elif username != current and not request.session.get("is_admin", False):
+        return JSONResponse({"error": "Không có quyền."}, status_code=403)
+    row = await asyncio.to_thread(history.get_session, username, time_key)
+    if row is None:
+        return JSONResponse({"error": "Session không tồn tại."}, status_code=404)
+    return JSONResponse(row)
@@ -0,0 +1,156 @@
+from fastapi import APIRouter, Request, Form
+from fastapi.responses import JSONResponse
+from api_audio import audio_url, is_safe_name
+import os
+import json
+import asyncio
+from voicepeak_wrapper.voicepeak import EMOTION_NAME
+import config
+import engine
+import history
+import storage
+import synthesis
+import transcode
+
+router = APIRouter()
+
+STATIC_DIR = config.STATIC_DIR
+
+# Giới hạn MATRIX_CONCURRENCY tiến trình VOICEPEAK cho mọi request render ma trận cộng lại
+_slots: asyncio.Semaphore | None = None
+
+
+def matrix_slots():
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(config.MATRIX_CONCURRENCY)
+    return _slots
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def is_narrator(value):
+    return isinstance(value, str) and value.strip() != ""
+
+
+def is_emotion(value):
+    if value is None:
+        return True
+    if not isinstance(value, dict):
+        return False
+    return all(isinstance(key, str) and EMOTION_NAME.match(key) and is_int(level) for key, level in value.items())
+
+
+def is_optional_int(value):
+    return value is None or is_int(value)
+
+
+def parse_json_list(value, name, is_valid):
+    """
+    Đọc list JSON từ form và kiểm tra kiểu từng phần tử. Chuỗi rỗng được coi là [null] (không chỉ định).
+    """
+    if not value.strip():
+        return [None]
+    parsed = json.loads(value)
+    if not isinstance(parsed, list) or len(parsed) == 0:
+        raise ValueError(f"{name} phải là list JSON không rỗng")
+    for item in parsed:
+        if not is_valid(item):
+            raise ValueError(f"Giá trị không hợp lệ trong {name}: {json.dumps(item, ensure_ascii=False)}")
+    return parsed
+
+
+@router.post("/api/render-matrix")
+async def render_matrix(
+    request: Request,
+    username: str = Form(...),
+    time_key: str = Form(...),
+    text: str = Form(...),
+    narrators: str = Form(...),
+    emotions: str = Form(""),
+    speeds: str = Form(""),
+    pitches: str = Form("")
+):
+    """
+    Đọc cùng một câu với mọi tổ hợp narrator × cảm xúc × tốc độ × cao độ và nối thành file nghe thử audition.wav.
+    narrators, emotions, speeds, pitches là list JSON, ví dụ emotions='[{"happy": 100}, {"sad": 50}, null]'.
+    """
+    current = request.session.get("username")
+    if not current:
+        return JSONResponse({"error": "Chưa đăng nhập."}, status_code=401)
+    if username != current and not request.session.get("is_admin", False):
+        return JSONResponse({"error": "Không có quyền."}, status_code=403)
+    if not username or not text.strip() or not time_key:
+        return JSONResponse({"error": "Thiếu thông tin."}, status_code=400)
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
+    try:
+        narrator_list = parse_json_list(narrators, "narrators", is_narrator)
+        emotion_list = parse_json_list(emotions, "emotions", is_emotion)
+        speed_list = parse_json_list(speeds, "speeds", is_optional_int)
+        pitch_list = parse_json_list(pitches, "pitches", is_optional_int)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if None in narrator_list:
+        return JSONResponse({"error": "Cần chỉ định narrators."}, status_code=400)
+    cell_count = len(narrator_list) * len(emotion_list) * len(speed_list) * len(pitch_list)
+    if cell_count > config.MATRIX_MAX_CELLS:
+        return JSONResponse(
+            {"error": f"Quá nhiều tổ hợp ({cell_count} > {config.MATRIX_MAX_CELLS})."}, status_code=400
+        )
+    if not await asyncio.to_thread(storage.enforce_quota, username, time_key):
+        return JSONResponse({"error": "Đã vượt quá dung lượng lưu trữ cho phép."}, status_code=507)
+
+    user_dir = os.path.join(STATIC_DIR, username, time_key)
+    matrix_dir = os.path.join(user_dir, "matrix")
+    audition_path = os.path.join(user_dir, "audition.wav")
+    client = engine.get_client(request)
+    try:
+        # Tính là việc tạo voice người dùng đang chờ: các dòng nháp nhường cho render ma trận
+        with synthesis.foreground():
+            cells = await client.render_matrix(
+                text,
+                matrix_dir,
+                narrators=narrator_list,
+                emotions=emotion_list,
+                speeds=speed_list,
+                pitches=pitch_list,
+                semaphore=matrix_slots(),
+                audition_path=audition_path,
+            )
+    except (ValueError, TypeError) as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+
+    rendered = [cell.output_path for cell in cells if cell.error is None]
+    if os.path.exists(audition_path) and rendered:
+        rendered.append(audition_path)
+        transcode.prewarm(username, time_key, audition_path)
+    await asyncio.to_thread(storage.track_files, username, time_key, *rendered)
+    audition_end_ms = max((cell.audition_end_ms or 0 for cell in cells), default=0)
+    await asyncio.to_thread(
+        history.finish_session, username, time_key,
+        history.STATUS_COMPLETED if rendered else history.STATUS_FAILED,
+        line_count=len(cells), total_duration=audition_end_ms / 1000, voice=", ".join(narrator_list)
+    )
+
+    return JSONResponse({
+        "audition_url": await audio_url(username, time_key, "audition.wav") if len(rendered) != 0 else None,
+        "total_cells": len(cells),
+        "failed_cells": sum(1 for cell in cells if cell.error is not None),
+        "cells": [
+            {
+                "index": cell.index,
+                "narrator": cell.narrator,
+                "emotions": cell.emotions,
+                "speed": cell.speed,
+                "pitch": cell.pitch,
+                "wav_url": f"static/{username}/{time_key}/matrix/{cell.index:03d}.wav" if cell.error is None else None,
+                "error": cell.error,
+                "audition_start_seconds": None if cell.audition_start_ms is None else cell.audition_start_ms / 1000,
+                "audition_end_seconds": None if cell.audition_end_ms is None else cell.audition_end_ms / 1000,
+            }
+            for cell in cells
+        ]
+    })
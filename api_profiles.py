@@ -0,0 +1,70 @@
+from fastapi import APIRouter, Request, Query
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
+import asyncio
+import json
+import os
+import profiling
+from api_audio import is_safe_name
+
+router = APIRouter()
+
+
+def is_admin(request):
+    return bool(request.session.get("username")) and request.session.get("is_admin", False)
+
+
+@router.get("/admin/profiles")
+async def list_profiles(
+    request: Request,
+    limit: int = Query(50, ge=1, le=1000),
+    username: str | None = None,
+    time_key: str | None = None
+):
+    """
+    Các profile gần đây (giữ trong bộ nhớ từ lúc server khởi động). Có username và time_key thì liệt kê
+    các profile đã lưu của session đó trên đĩa (kể cả từ trước khi khởi động lại).
+    """
+    if not is_admin(request):
+        return JSONResponse({"error": "Không có quyền."}, status_code=403)
+    if username is None or time_key is None:
+        return JSONResponse({"profiles": list(profiling.recent)[:limit]})
+    if not is_safe_name(username) or not is_safe_name(time_key):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
+    profile_ids = await asyncio.to_thread(profiling.list_saved, username, time_key)
+    return JSONResponse({
+        "profiles": [
+            {"id": profile_id, "username": username, "time_key": time_key} for profile_id in profile_ids[:limit]
+        ]
+    })
+
+
+@router.get("/admin/profiles/{username}/{time_key}/{profile_id}")
+async def download_profile(
+    request: Request,
+    username: str,
+    time_key: str,
+    profile_id: str,
+    fmt: str = Query("json", alias="format")
+):
+    """
+    Tải một profile: ?format=json (mặc định, đầy đủ timeline và mẫu) hoặc ?format=folded (chỉ stack đã gộp,
+    cho flamegraph.pl / speedscope).
+    """
+    if not is_admin(request):
+        return JSONResponse({"error": "Không có quyền."}, status_code=403)
+    if not all(is_safe_name(name) for name in (username, time_key, profile_id)):
+        return JSONResponse({"error": "Đường dẫn không hợp lệ."}, status_code=400)
+    if fmt not in ("json", "folded"):
+        return JSONResponse({"error": "Định dạng không hỗ trợ."}, status_code=400)
+    path = profiling.profile_path(username, time_key, profile_id)
+    if not os.path.isfile(path):
+        return JSONResponse({"error": "Profile không tồn tại."}, status_code=404)
+    if fmt == "json":
+        return FileResponse(path, media_type="application/json", filename=f"{profile_id}.json")
+
+    def read_folded():
+        with open(path, encoding="utf-8") as f:
+            samples = json.load(f)["samples"]
+        return "".join(f"{stack} {count}\n" for stack, count in samples.items())
+
+    return PlainTextResponse(await asyncio.to_thread(read_folded))
@@ -0,0 +1,286 @@
+"""
+Benchmark cho pipeline audio và request của server.
+
+Chạy hoàn toàn offline trên Linux: engine VOICEPEAK được thay bằng test/stub_voicepeak.py,
+static/ và users.db được tạo trong thư mục tạm. Kết quả xuất ra JSON để so sánh giữa các lần deploy.
+
+    python bench/bench_pipeline.py --output bench.json
+    python bench/bench_pipeline.py --compare bench.json --threshold 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "test"))
+
+import stub_voicepeak  # noqa: E402
+
+SAMPLE_RATE = 48000
+LINE_DURATION_MS = 1500
+USERNAME = "bench"
+
+
+def summarize(name: str, params: dict, samples: list[float], unit: str = "s", **extra) -> dict:
+    return {
+        "name": name,
+        "params": params,
+        "unit": unit,
+        "samples": samples,
+        "min": min(samples),
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        **extra,
+    }
+
+
+def make_session(static_dir: str, time_key: str, lines: int) -> str:
+    """
+    Tạo thư mục session giả gồm các file 00.wav/00.txt giống output của /api/generate-line
+    """
+    user_dir = os.path.join(static_dir, USERNAME, time_key)
+    os.makedirs(user_dir, exist_ok=True)
+    for idx in range(lines):
+        stub_voicepeak.write_silence(os.path.join(user_dir, f"{idx:02d}.wav"), LINE_DURATION_MS, SAMPLE_RATE)
+        with open(os.path.join(user_dir, f"{idx:02d}.txt"), "w", encoding="utf-8") as f:
+            f.write(f"本日は晴天なり {idx}")
+    return user_dir
+
+
+def bench_make_say_command(exe_path: str, iterations: int, repeat: int) -> dict:
+    from voicepeak_wrapper.voicepeak import Voicepeak
+
+    client = Voicepeak(exe_path)
+    make = client._Voicepeak__make_say_command
+    emotions = {"happy": 50, "sad": 20, "angry": 0, "fun": 100}
+    samples = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for idx in range(iterations):
+            make(
+                text=f"本日は晴天なり {idx}",
+                output_path=f"/tmp/out_{idx}.wav",
+                narrator="Japanese Female 1",
+                emotions=emotions,
+                speed=120,
+                pitch=-50,
+            )
+        samples.append((time.perf_counter() - start) / iterations * 1e6)
+    return summarize("make_say_command", {"iterations": iterations}, samples, unit="us/call")
+
+
+def bench_merge_audio(static_dir: str, sizes: list[int], repeat: int) -> list[dict]:
+    import api_generate_line
+
+    results = list()
+    for size in sizes:
+        time_key = f"merge_{size}"
+        make_session(static_dir, time_key, size)
+        samples = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = asyncio.run(api_generate_line.merge_audio(None, username=USERNAME, time_key=time_key))
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"merge_audio lỗi: {response.body!r}")
+        body = json.loads(response.body)
+        if body["total_lines"] != size:
+            raise RuntimeError(f"merge_audio chỉ nối {body['total_lines']}/{size} dòng")
+        results.append(summarize("merge_audio", {"lines": size}, samples))
+
+        samples = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for ms in range(0, size * LINE_DURATION_MS, LINE_DURATION_MS):
+                api_generate_line.format_srt_time(ms)
+            samples.append(time.perf_counter() - start)
+        results.append(summarize("format_srt_time", {"lines": size}, samples))
+    return results
+
+
+def bench_download_zip(static_dir: str, sizes: list[int], repeat: int) -> list[dict]:
+    import api_generate_line
+
+    results = list()
+    for size in sizes:
+        time_key = f"zip_{size}"
+        make_session(static_dir, time_key, size)
+        samples = list()
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = asyncio.run(api_generate_line.download_zip(None, username=USERNAME, time_key=time_key))
+            samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"download_zip lỗi: {response.body!r}")
+        zip_bytes = os.path.getsize(response.path)
+        results.append(summarize("download_zip", {"lines": size}, samples, zip_bytes=zip_bytes))
+    return results
+
+
+async def bench_requests(requests: int, concurrency: int, lines: int, repeat: int) -> list[dict]:
+    import httpx
+    import server
+
+    results = list()
+    transport = httpx.ASGITransport(app=server.app)
+    # ASGITransport không chạy lifespan: tự chạy để có client dùng chung và engine đã làm nóng như khi deploy
+    startup = time.perf_counter()
+    async with server.app.router.lifespan_context(server.app), httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        while (await client.get("/readyz")).status_code != 200:
+            if server.app.state.engine.error is not None or time.perf_counter() - startup > 60:
+                raise RuntimeError(f"engine không sẵn sàng: {server.app.state.engine.status()}")
+            await asyncio.sleep(0.01)
+        results.append(summarize("startup_ready", {}, [time.perf_counter() - startup]))
+
+        response = await client.post("/login", data={"username": "admin", "password": "admin123"})
+        if response.status_code != 303:
+            raise RuntimeError(f"login lỗi: {response.status_code}")
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies = list()
+
+        async def one(time_key: str, idx: int):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/api/generate-line",
+                    data={
+                        "username": USERNAME,
+                        "voice": "Japanese Female 1",
+                        # Mỗi lần đo dùng câu khác nhau để không trúng cache tổng hợp giọng
+                        "line": f"本日は晴天なり {time_key} {idx}",
+                        "index": str(idx),
+                        "time_key": time_key,
+                    },
+                )
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError(f"/api/generate-line lỗi: {response.text}")
+
+        samples = list()
+        for run in range(repeat):
+            start = time.perf_counter()
+            await asyncio.gather(*(one(f"lines_{run}", idx) for idx in range(requests)))
+            samples.append(requests / (time.perf_counter() - start))
+        latencies.sort()
+        results.append(
+            summarize(
+                "api_generate_line",
+                {"requests": requests, "concurrency": concurrency},
+                samples,
+                unit="req/s",
+                latency_p50=latencies[len(latencies) // 2],
+                latency_p95=latencies[int(len(latencies) * 0.95) - 1],
+            )
+        )
+
+        samples = list()
+        for run in range(repeat):
+            text_content = "\n".join(f"本日は晴天なり {run} {idx}" for idx in range(lines))
+            start = time.perf_counter()
+            response = await client.post("/generate", data={"voice": "Japanese Female 1", "text_content": text_content})
+            samples.append(lines / (time.perf_counter() - start))
+            if response.status_code != 200:
+                raise RuntimeError(f"/generate lỗi: {response.status_code}")
+            # /generate đặt tên thư mục theo giây, chờ để lần chạy sau không ghi đè
+            await asyncio.sleep(1)
+        results.append(summarize("generate", {"lines": lines}, samples, unit="lines/s"))
+    return results
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[str]:
+    """
+    So sánh median với file kết quả cũ. Đơn vị thời gian càng nhỏ càng tốt, đơn vị x/s càng lớn càng tốt.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"]}
+    regressions = list()
+    for result in results:
+        old = baseline.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old is None or old["median"] == 0:
+            continue
+        ratio = result["median"] / old["median"]
+        if result["unit"].endswith("/s"):
+            ratio = 1 / ratio if ratio else float("inf")
+        if ratio > 1 + threshold:
+            regressions.append(f"{result['name']} {result['params']}: {old['median']:.6g} -> {result['median']:.6g}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000", help="Số dòng cho merge_audio/download_zip")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--command-iterations", type=int, default=10000)
+    parser.add_argument("--requests", type=int, default=50, help="Số request /api/generate-line mỗi lần đo")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--generate-lines", type=int, default=20, help="Số dòng gửi lên /generate")
+    parser.add_argument("--skip-requests", action="store_true", help="Bỏ qua benchmark end-to-end qua HTTP")
+    parser.add_argument("--output", help="Ghi JSON ra file thay vì stdout")
+    parser.add_argument("--compare", help="File JSON kết quả cũ để phát hiện regression")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Tỉ lệ chậm đi tối đa cho phép khi --compare")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    work_dir = tempfile.mkdtemp(prefix="voicepeak_bench_")
+    try:
+        static_dir = os.path.join(work_dir, "static")
+        os.makedirs(static_dir)
+        exe_path = stub_voicepeak.make_stub_executable(work_dir)
+        os.environ["VOICEPEAK_STATIC_DIR"] = static_dir
+        os.environ["VOICEPEAK_DB_PATH"] = os.path.join(work_dir, "users.db")
+        os.environ["VOICEPEAK_EXE"] = exe_path
+        os.environ["VOICEPEAK_SYNTH_CACHE_DIR"] = os.path.join(work_dir, "synth_cache")
+        os.environ["VOICEPEAK_ZIP_DIR"] = os.path.join(work_dir, "zip")
+        # Khởi tạo users.db (bảng users, kế toán lưu trữ, lịch sử) trong thư mục tạm
+        import server
+        server.init_db()
+
+        results = [bench_make_say_command(exe_path, args.command_iterations, args.repeat)]
+        results += bench_merge_audio(static_dir, sizes, args.repeat)
+        results += bench_download_zip(static_dir, sizes, args.repeat)
+        if not args.skip_requests:
+            results += asyncio.run(bench_requests(args.requests, args.concurrency, args.generate_lines, args.repeat))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+
+# Cấu hình dùng chung cho server và các router API.
+# Mọi giá trị đều có thể ghi đè bằng biến môi trường (dùng cho benchmark, test, deploy).
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STATIC_DIR = os.environ.get("VOICEPEAK_STATIC_DIR", os.path.join(BASE_DIR, "static"))
+DB_PATH = os.environ.get("VOICEPEAK_DB_PATH", os.path.join(BASE_DIR, "users.db"))
+VOICEPEAK_EXE = os.environ.get(
+    "VOICEPEAK_EXE",
+    os.path.join(os.environ.get("ProgramFiles", ""), "VOICEPEAK", "voicepeak.exe"),
+)
+
+# Lưu trữ: quota mỗi user (byte, 0 = không giới hạn) và chính sách dọn dẹp session cũ
+STORAGE_QUOTA_BYTES = int(os.environ.get("VOICEPEAK_STORAGE_QUOTA_BYTES", "0"))
+SESSION_RETENTION_SECONDS = int(os.environ.get("VOICEPEAK_SESSION_RETENTION_SECONDS", str(7 * 24 * 3600)))
+ZIP_DIR = os.environ.get("VOICEPEAK_ZIP_DIR", os.path.join(tempfile.gettempdir(), "voicepeak_zip"))
+ZIP_RETENTION_SECONDS = int(os.environ.get("VOICEPEAK_ZIP_RETENTION_SECONDS", "3600"))
+SWEEP_INTERVAL_SECONDS = int(os.environ.get("VOICEPEAK_SWEEP_INTERVAL_SECONDS", "600"))
+# Session được ghi hoặc nghe trong khoảng này (giây) được coi là đang dùng, bộ dọn dẹp không xóa để ép quota
+SWEEP_ACTIVE_SECONDS = int(os.environ.get("VOICEPEAK_SWEEP_ACTIVE_SECONDS", "900"))
+# Nghe lại file audio cập nhật last_access của session (cho LRU), tối đa một lần mỗi khoảng này (giây)
+ACCESS_TOUCH_INTERVAL_SECONDS = int(os.environ.get("VOICEPEAK_ACCESS_TOUCH_INTERVAL_SECONDS", "60"))
+
+# Bản nén để nghe thử (cần ffmpeg, flac, lame hoặc opusenc trong PATH)
+TRANSCODE_MP3_KBPS = int(os.environ.get("VOICEPEAK_TRANSCODE_MP3_KBPS", "96"))
+TRANSCODE_OPUS_KBPS = int(os.environ.get("VOICEPEAK_TRANSCODE_OPUS_KBPS", "48"))
+
+# Render ma trận narrator × cảm xúc × tốc độ × cao độ
+MATRIX_MAX_CELLS = int(os.environ.get("VOICEPEAK_MATRIX_MAX_CELLS", "500"))
+MATRIX_CONCURRENCY = int(os.environ.get("VOICEPEAK_MATRIX_CONCURRENCY", "4"))
+
+# Đọc script dạng luồng: số dòng tối đa chờ tạo voice trước khi ngừng đọc body
+INGEST_QUEUE_LINES = int(os.environ.get("VOICEPEAK_INGEST_QUEUE_LINES", "32"))
+
+# Cache kết quả tổng hợp giọng và tạo trước (speculative) khi người dùng đang gõ
+SYNTH_CACHE_DIR = os.environ.get("VOICEPEAK_SYNTH_CACHE_DIR", os.path.join(BASE_DIR, "synth_cache"))
+SYNTH_CACHE_MAX_BYTES = int(os.environ.get("VOICEPEAK_SYNTH_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+SPECULATIVE_WORKERS = int(os.environ.get("VOICEPEAK_SPECULATIVE_WORKERS", "1"))
+SPECULATIVE_MAX_LINES = int(os.environ.get("VOICEPEAK_SPECULATIVE_MAX_LINES", "200"))
+# Tổng số dòng nháp đang chờ tạo của mọi user; vượt quá thì dòng mới không được tạo trước
+SPECULATIVE_MAX_PENDING = int(os.environ.get("VOICEPEAK_SPECULATIVE_MAX_PENDING", "1000"))
+
+# Khởi động: tạo thử một câu với từng narrator để làm nóng engine trước khi /readyz báo sẵn sàng.
+# WARMUP_NARRATORS rỗng = mọi narrator trong danh mục, WARMUP_ENABLED=0 để bỏ qua bước này
+WARMUP_ENABLED = os.environ.get("VOICEPEAK_WARMUP_ENABLED", "1") != "0"
+WARMUP_NARRATORS = [
+    name.strip() for name in os.environ.get("VOICEPEAK_WARMUP_NARRATORS", "").split(",") if name.strip()
+]
+WARMUP_TEXT = os.environ.get("VOICEPEAK_WARMUP_TEXT", "テスト")
+# Tải danh mục / làm nóng lỗi thì thử lại sau ENGINE_RETRY_SECONDS, gấp đôi mỗi lần, tối đa ENGINE_RETRY_MAX_SECONDS
+ENGINE_RETRY_SECONDS = float(os.environ.get("VOICEPEAK_ENGINE_RETRY_SECONDS", "1"))
+ENGINE_RETRY_MAX_SECONDS = float(os.environ.get("VOICEPEAK_ENGINE_RETRY_MAX_SECONDS", "60"))
+
+# Profiling: bật cho một request bằng header X-Profile: 1, hoặc cho mọi request tạo voice bằng PROFILE_ALL=1.
+# Profile được lưu trong thư mục profiles/ của session, admin xem qua /admin/profiles
+PROFILE_ALL = os.environ.get("VOICEPEAK_PROFILE_ALL", "0") == "1"
+PROFILE_HEADER = os.environ.get("VOICEPEAK_PROFILE_HEADER", "X-Profile")
+# Header chỉ có hiệu lực với session admin, hoặc khi giá trị header bằng PROFILE_TOKEN (nếu có đặt)
+PROFILE_TOKEN = os.environ.get("VOICEPEAK_PROFILE_TOKEN", "")
+PROFILE_INTERVAL_MS = float(os.environ.get("VOICEPEAK_PROFILE_INTERVAL_MS", "5"))
+PROFILE_RECENT = int(os.environ.get("VOICEPEAK_PROFILE_RECENT", "100"))
@@ -0,0 +1,28 @@
+import sqlite3
+from contextlib import contextmanager
+
+import config
+
+# Kết nối tới users.db dùng chung cho storage và history (autocommit, transaction tường minh).
+
+
+def connect():
+    conn = sqlite3.connect(config.DB_PATH, timeout=30)
+    conn.isolation_level = None
+    return conn
+
+
+@contextmanager
+def transaction():
+    conn = connect()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        yield c
+        c.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            c.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
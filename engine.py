@@ -0,0 +1,95 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import config
+from voicepeak_wrapper.voicepeak import Voicepeak
+
+# Engine dùng chung cho cả app: một client Voicepeak tạo trong lifespan (thay vì mỗi request tạo lại
+# và kiểm tra lại đường dẫn exe), danh mục narrator tải sẵn và trạng thái làm nóng engine cho /readyz.
+
+
+class Engine:
+    def __init__(self, exe_path=None):
+        self.exe_path = exe_path or config.VOICEPEAK_EXE
+        self.client = None
+        self.narrators = ()
+        self.warmed = list()
+        self.warm_failed = list()
+        self.attempts = 0
+        self.error = None
+        self.ready = False
+        self.started_at = time.time()
+        self.ready_at = None
+        try:
+            self.client = Voicepeak(self.exe_path)
+        except FileNotFoundError as e:
+            self.error = str(e)
+
+    async def start(self):
+        """
+        Tải danh mục narrator rồi làm nóng engine. Chạy nền trong lifespan, /readyz trả 503 cho tới khi xong.
+        Lỗi (engine chưa sẵn sàng, không narrator nào làm nóng được) thì thử lại với backoff tăng dần.
+        """
+        if self.client is None:
+            return
+        delay = config.ENGINE_RETRY_SECONDS
+        while True:
+            self.attempts += 1
+            try:
+                self.narrators = await self.client.get_narrator_list()
+                if config.WARMUP_ENABLED:
+                    await self.warm_up()
+                break
+            except Exception as e:
+                self.error = str(e)
+                print(f"Lỗi khi khởi động engine VOICEPEAK (lần {self.attempts}), thử lại sau {delay:g}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, config.ENGINE_RETRY_MAX_SECONDS)
+        self.error = None
+        self.ready = True
+        self.ready_at = time.time()
+
+    async def warm_up(self):
+        """
+        Tạo thử một câu với từng narrator (file tạm, xóa ngay) để binary và dữ liệu giọng được nạp sẵn.
+        Narrator lỗi được bỏ qua (ghi vào warm_failed); chỉ báo lỗi khi không narrator nào tạo được.
+        """
+        names = config.WARMUP_NARRATORS or [narrator.name for narrator in self.narrators]
+        self.warmed = list()
+        self.warm_failed = list()
+        errors = list()
+        with tempfile.TemporaryDirectory(prefix="voicepeak_warmup_") as tmp_dir:
+            for idx, name in enumerate(names):
+                output_path = os.path.join(tmp_dir, f"{idx}.wav")
+                try:
+                    await self.client.say_text(config.WARMUP_TEXT, output_path=output_path, narrator=name)
+                except (RuntimeError, ValueError) as e:
+                    self.warm_failed.append(name)
+                    errors.append(f"{name}: {e}")
+                    continue
+                self.warmed.append(name)
+        if names and not self.warmed:
+            raise RuntimeError("Không làm nóng được narrator nào. " + "; ".join(errors))
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "narrators": len(self.narrators),
+            "warmed": list(self.warmed),
+            "warm_failed": list(self.warm_failed),
+            "attempts": self.attempts,
+            "startup_seconds": None if self.ready_at is None else round(self.ready_at - self.started_at, 3),
+        }
+
+
+def get_client(request):
+    """
+    Client dùng chung của app. Nếu app chưa chạy lifespan (gọi handler trực tiếp) thì tạo client riêng như trước.
+    """
+    engine = getattr(request.app.state, "engine", None)
+    if engine is not None and engine.client is not None:
+        return engine.client
+    return Voicepeak(config.VOICEPEAK_EXE)
@@ -0,0 +1,216 @@
+import sqlite3
+import time
+
+import db
+
+# Lịch sử các phiên tạo voice (bảng sessions trong users.db, cạnh bảng users).
+# Danh sách lịch sử được trả lời hoàn toàn từ index (username, created_at), không duyệt static/.
+
+STATUS_RENDERING = "rendering"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_EVICTED = "evicted"
+
+COLUMNS = ("id", "username", "time_key", "voice", "line_count", "total_duration", "byte_size", "status",
+           "created_at", "updated_at")
+
+
+def init_history_db():
+    """
+    Tạo bảng sessions. Lần đầu tạo bảng sẽ nhập các session đã có từ bảng kế toán lưu trữ (không duyệt static/).
+    """
+    with db.transaction() as c:
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='sessions'")
+        is_new = c.fetchone() is None
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL,
+                time_key TEXT NOT NULL,
+                voice TEXT,
+                line_count INTEGER NOT NULL DEFAULT 0,
+                total_duration REAL,
+                byte_size INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                UNIQUE (username, time_key)
+            )
+        """)
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_user_created ON sessions (username, created_at, id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at, id)")
+        if is_new:
+            c.execute(
+                """
+                INSERT OR IGNORE INTO sessions
+                    (username, time_key, line_count, byte_size, status, created_at, updated_at)
+                SELECT s.username, s.time_key,
+                    (SELECT COUNT(*) FROM storage_files f
+                     WHERE f.username = s.username AND f.time_key = s.time_key
+                     AND (f.name GLOB '[0-9][0-9]*.wav' OR f.name GLOB 'voice_*.wav')),
+                    s.bytes,
+                    CASE WHEN EXISTS (SELECT 1 FROM storage_files f
+                                      WHERE f.username = s.username AND f.time_key = s.time_key
+                                      AND f.name = 'full.wav')
+                         THEN ? ELSE ? END,
+                    s.last_access, s.last_access
+                FROM storage_sessions s
+                """,
+                (STATUS_COMPLETED, STATUS_RENDERING),
+            )
+
+
+def record_line(username, time_key, voice, index):
+    """
+    Ghi nhận một dòng đã được tạo trong session (tạo session nếu chưa có).
+    """
+    now = time.time()
+    with db.transaction() as c:
+        c.execute(
+            """
+            INSERT INTO sessions (username, time_key, voice, line_count, byte_size, status, created_at, updated_at)
+            VALUES (?, ?, ?, ?, COALESCE((SELECT bytes FROM storage_sessions WHERE username=? AND time_key=?), 0),
+                    ?, ?, ?)
+            ON CONFLICT (username, time_key) DO UPDATE SET
+                voice = excluded.voice,
+                line_count = MAX(line_count, excluded.line_count),
+                byte_size = excluded.byte_size,
+                status = excluded.status,
+                updated_at = excluded.updated_at
+            """,
+            (username, time_key, voice, index + 1, username, time_key, STATUS_RENDERING, now, now),
+        )
+
+
+def finish_session(username, time_key, status, line_count=None, total_duration=None, voice=None):
+    """
+    Cập nhật trạng thái cuối của session (sau merge, sau /generate, ...).
+    """
+    now = time.time()
+    with db.transaction() as c:
+        c.execute(
+            """
+            INSERT INTO sessions
+                (username, time_key, voice, line_count, total_duration, byte_size, status, created_at, updated_at)
+            VALUES (?, ?, ?, COALESCE(?, 0), ?,
+                    COALESCE((SELECT bytes FROM storage_sessions WHERE username=? AND time_key=?), 0), ?, ?, ?)
+            ON CONFLICT (username, time_key) DO UPDATE SET
+                voice = COALESCE(excluded.voice, voice),
+                line_count = COALESCE(?, line_count),
+                total_duration = COALESCE(excluded.total_duration, total_duration),
+                byte_size = excluded.byte_size,
+                status = excluded.status,
+                updated_at = excluded.updated_at
+            """,
+            (username, time_key, voice, line_count, total_duration, username, time_key, status, now, now,
+             line_count),
+        )
+
+
+def _update_if_initialized(c, sql, params):
+    # storage gọi vào đây trong transaction của nó; nếu users.db chưa có bảng sessions
+    # (chưa gọi init_history_db, ví dụ chỉ dùng storage) thì bỏ qua
+    try:
+        c.execute(sql, params)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+
+
+def sync_byte_size(c, username, time_key):
+    """
+    Cập nhật byte_size theo kế toán dung lượng, gọi từ storage.track_files trong cùng transaction.
+    """
+    _update_if_initialized(
+        c,
+        """
+        UPDATE sessions SET byte_size = (SELECT bytes FROM storage_sessions WHERE username=? AND time_key=?)
+        WHERE username=? AND time_key=?
+        """,
+        (username, time_key, username, time_key),
+    )
+
+
+def mark_evicted(c, username, time_key):
+    """
+    Session bị xóa file vẫn được giữ trong lịch sử, chỉ đánh dấu evicted. Gọi từ storage.evict_session.
+    """
+    _update_if_initialized(
+        c,
+        "UPDATE sessions SET status=?, byte_size=0, updated_at=? WHERE username=? AND time_key=?",
+        (STATUS_EVICTED, time.time(), username, time_key),
+    )
+
+
+def active_time_keys(username, since):
+    """
+    Các session của user còn đang tạo (status rendering, cập nhật từ thời điểm since trở đi).
+    Trả về set rỗng nếu chưa có bảng sessions.
+    """
+    conn = db.connect()
+    c = conn.cursor()
+    try:
+        c.execute(
+            "SELECT time_key FROM sessions WHERE username=? AND status=? AND updated_at >= ?",
+            (username, STATUS_RENDERING, since),
+        )
+        return {row[0] for row in c.fetchall()}
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        return set()
+    finally:
+        conn.close()
+
+
+def encode_cursor(row):
+    return f"{row['created_at']!r}:{row['id']}"
+
+
+def decode_cursor(cursor):
+    created_at, session_id = cursor.rsplit(":", 1)
+    return float(created_at), int(session_id)
+
+
+def list_sessions(username=None, limit=20, before=None, status=None):
+    """
+    Lấy một trang lịch sử, mới nhất trước. Phân trang bằng con trỏ (keyset) nên thời gian truy vấn
+    không phụ thuộc số session hay trang thứ mấy.
+
+    Trả về:
+        tuple[list[dict], str | None]: Danh sách session và con trỏ của trang tiếp theo (None nếu hết)
+    """
+    where = list()
+    params = list()
+    if username is not None:
+        where.append("username = ?")
+        params.append(username)
+    if status is not None:
+        where.append("status = ?")
+        params.append(status)
+    if before is not None:
+        created_at, session_id = decode_cursor(before)
+        where.append("(created_at < ? OR (created_at = ? AND id < ?))")
+        params += [created_at, created_at, session_id]
+    sql = f"SELECT {', '.join(COLUMNS)} FROM sessions"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute(sql, params)
+    rows = [dict(zip(COLUMNS, row)) for row in c.fetchall()]
+    conn.close()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def get_session(username, time_key):
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute(f"SELECT {', '.join(COLUMNS)} FROM sessions WHERE username=? AND time_key=?", (username, time_key))
+    row = c.fetchone()
+    conn.close()
+    return dict(zip(COLUMNS, row)) if row else None
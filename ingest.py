@@ -0,0 +1,116 @@
+import codecs
+import re
+
+# Đọc script dạng luồng: nhận từng chunk bytes (upload, request body), tự nhận diện encoding
+# và trả về từng dòng ngay khi đọc xong, bộ nhớ chỉ giữ phần dòng đang dở.
+
+# VOICEPEAK từ chối văn bản dài hơn 140 ký tự
+MAX_LINE_CHARS = 140
+SNIFF_BYTES = 4096
+SENTENCE_END = re.compile(r"(?<=[。！？!?．])")
+BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def detect_encoding(head):
+    """
+    Nhận diện encoding từ các byte đầu: BOM, UTF-8, nếu không hợp lệ thì coi là Shift_JIS (cp932).
+    """
+    for bom, encoding in BOMS:
+        if head.startswith(bom):
+            return encoding
+    try:
+        # final=False: ký tự nhiều byte bị cắt ở cuối head không bị coi là lỗi
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "cp932"
+
+
+def split_sentences(line, max_chars=MAX_LINE_CHARS):
+    """
+    Tách dòng dài hơn max_chars theo dấu kết thúc câu, gộp các câu ngắn lại cho tới max_chars.
+    Câu vẫn dài hơn max_chars thì bị cắt cứng.
+    """
+    if len(line) <= max_chars:
+        return [line]
+    chunks = list()
+    current = ""
+    for sentence in SENTENCE_END.split(line):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        while len(sentence) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(sentence[:max_chars])
+            sentence = sentence[max_chars:].strip()
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+async def iter_lines(chunks, max_chars=MAX_LINE_CHARS, encoding=None):
+    """
+    Async generator: nhận async iterator các chunk bytes, yield từng dòng (đã strip, bỏ dòng trống,
+    dòng dài được tách theo câu) ngay khi đọc xong dòng đó.
+    """
+    head = b""
+    decoder = None
+    pending = ""
+    async for chunk in chunks:
+        if decoder is None:
+            head += chunk
+            if len(head) < SNIFF_BYTES:
+                continue
+            decoder = codecs.getincrementaldecoder(encoding or detect_encoding(head))(errors="replace")
+            chunk, head = head, b""
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            for sentence in split_sentences(line.strip(), max_chars):
+                if sentence:
+                    yield sentence
+        # Dòng rất dài không có xuống dòng: trả trước các câu đã hoàn chỉnh để giới hạn bộ nhớ
+        if len(pending) > max_chars * 4:
+            *sentences, pending = split_sentences(pending.strip(), max_chars)
+            for sentence in sentences:
+                yield sentence
+    if decoder is None:
+        decoder = codecs.getincrementaldecoder(encoding or detect_encoding(head))(errors="replace")
+        pending += decoder.decode(head)
+    pending += decoder.decode(b"", final=True)
+    for line in pending.split("\n"):
+        for sentence in split_sentences(line.strip(), max_chars):
+            if sentence:
+                yield sentence
+
+
+async def iter_upload(upload, chunk_size=64 * 1024, copy_to=None):
+    """
+    Đọc UploadFile theo từng chunk. Nếu có copy_to thì đồng thời lưu lại bản gốc vào file đó.
+    """
+    copy = open(copy_to, "wb") if copy_to else None
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            if copy:
+                copy.write(chunk)
+            yield chunk
+    finally:
+        if copy:
+            copy.close()
+
+
+async def iter_text(text):
+    yield text.encode("utf-8")
@@ -0,0 +1,298 @@
+import asyncio
+import contextvars
+import functools
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+
+import config
+import storage
+
+# Profiling theo request (bật bằng header hoặc config): một thread lấy mẫu stack của mọi thread
+# (event loop, thread pool chạy say_text_sync, ...) và một timeline các span đánh dấu trong hot path.
+# Profile hiện tại nằm trong ContextVar nên đi theo cả task con lẫn asyncio.to_thread.
+# Chỉ có một thread lấy mẫu dùng chung cho mọi profile đang chạy. Stack của thread đang ở trong span
+# (thread pool) hoặc của task handler đang chạy trên event loop chỉ được tính cho profile sở hữu nó;
+# stack không thuộc profile nào (event loop rảnh, việc nền) được tính cho mọi profile đang chạy.
+
+PROFILE_DIR_NAME = "profiles"
+SAMPLER_THREAD_PREFIX = "voicepeak-profiler"
+
+_current = contextvars.ContextVar("voicepeak_profile", default=None)
+recent = deque(maxlen=config.PROFILE_RECENT)
+# thread ident -> các profile có span đang mở trong thread đó (ngoài event loop)
+_thread_owners: dict[int, list] = dict()
+# task handler -> profile của nó
+_task_owners: dict[asyncio.Task, "Profile"] = dict()
+
+
+class Profile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.id = f"{time.strftime('%Y%m%d_%H%M%S')}_{endpoint.strip('/').replace('/', '_')}_{uuid.uuid4().hex[:6]}"
+        self.username = None
+        self.time_key = None
+        self.started_at = time.time()
+        self.origin = time.perf_counter()
+        self.duration_ms = None
+        self.spans = list()
+        self.samples = Counter()
+        self.sample_count = 0
+        self.loop = None
+        self.loop_thread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread = threading.get_ident()
+        sampler.add(self)
+
+    def stop(self):
+        sampler.remove(self)
+        self.duration_ms = (time.perf_counter() - self.origin) * 1000
+
+    def add_span(self, name, start, end, attrs):
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.origin) * 1000, 3),
+            "end_ms": round((end - self.origin) * 1000, 3),
+            "task": task.get_name() if task is not None else None,
+            "thread": threading.current_thread().name,
+            **attrs,
+        })
+
+    def summary(self):
+        return {
+            "id": self.id,
+            "endpoint": self.endpoint,
+            "username": self.username,
+            "time_key": self.time_key,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+        }
+
+    def to_dict(self):
+        return {
+            **self.summary(),
+            "interval_ms": config.PROFILE_INTERVAL_MS,
+            "sample_count": self.sample_count,
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+            # Dạng folded stack ("thread;frame;frame": số mẫu), dùng trực tiếp được với flamegraph/speedscope
+            "samples": dict(self.samples.most_common()),
+        }
+
+
+class Sampler:
+    """
+    Thread lấy mẫu dùng chung: chạy khi có ít nhất một profile, dừng khi profile cuối cùng kết thúc.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = set()
+        self._thread = None
+        self._stop = None
+
+    def add(self, profile):
+        with self._lock:
+            self._profiles.add(profile)
+            if self._thread is None:
+                self._stop = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run, args=(self._stop,), name=SAMPLER_THREAD_PREFIX, daemon=True
+                )
+                self._thread.start()
+
+    def remove(self, profile):
+        with self._lock:
+            self._profiles.discard(profile)
+            if self._profiles or self._thread is None:
+                return
+            thread, stop = self._thread, self._stop
+            self._thread = None
+        stop.set()
+        thread.join()
+
+    def is_running(self):
+        return self._thread is not None
+
+    def _run(self, stop):
+        interval = config.PROFILE_INTERVAL_MS / 1000
+        while not stop.wait(interval):
+            # Giữ lock trong cả lượt lấy mẫu: sau khi remove() trả về, profile không còn bị ghi thêm mẫu
+            with self._lock:
+                if self._profiles:
+                    self.sample(set(self._profiles))
+
+    def sample(self, profiles):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            name = names.get(ident, str(ident))
+            if name.startswith(SAMPLER_THREAD_PREFIX):
+                continue
+            owners = owners_of(ident, profiles)
+            stack = list()
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join([name] + stack[::-1])
+            for profile in owners:
+                profile.samples[key] += 1
+        for profile in profiles:
+            profile.sample_count += 1
+
+
+def owners_of(ident, profiles):
+    """
+    Các profile được tính mẫu của thread ident: profile sở hữu thread/task đang chạy, nếu không có thì tất cả.
+    """
+    owned = {profile for profile in list(_thread_owners.get(ident, ())) if profile in profiles}
+    if owned:
+        return owned
+    for loop in {profile.loop for profile in profiles if profile.loop_thread == ident}:
+        owner = _task_owners.get(asyncio.current_task(loop))
+        if owner in profiles:
+            return {owner}
+    return profiles
+
+
+sampler = Sampler()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Đánh dấu một đoạn trong timeline của profile hiện tại. Không làm gì nếu request không được profile.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    ident = None
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        # Đang chạy trong thread pool: mẫu của thread này thuộc về profile hiện tại
+        ident = threading.get_ident()
+        _thread_owners.setdefault(ident, list()).append(profile)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, start, time.perf_counter(), attrs)
+        if ident is not None:
+            owners = _thread_owners[ident]
+            owners.remove(profile)
+            if not owners:
+                del _thread_owners[ident]
+
+
+def traced(name, func):
+    """
+    Bọc hàm chạy trong thread (asyncio.to_thread) bằng một span: so với span bao ngoài lời gọi to_thread
+    sẽ thấy được thời gian chờ thread pool.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def set_session(username, time_key):
+    profile = _current.get()
+    if profile is not None:
+        profile.username = username
+        profile.time_key = time_key
+
+
+def is_requested(request):
+    """
+    Profile request này không: luôn có nếu PROFILE_ALL. Header PROFILE_HEADER chỉ được tính khi session là admin
+    hoặc giá trị header khớp PROFILE_TOKEN, để client bất kỳ không bật được việc lấy mẫu tốn CPU.
+    """
+    if config.PROFILE_ALL:
+        return True
+    if request is None:
+        return False
+    value = request.headers.get(config.PROFILE_HEADER, "0")
+    if value in ("", "0"):
+        return False
+    session = request.scope.get("session") or dict()
+    if session.get("username") and session.get("is_admin", False):
+        return True
+    return bool(config.PROFILE_TOKEN) and hmac.compare_digest(value.encode(), config.PROFILE_TOKEN.encode())
+
+
+def profile_path(username, time_key, profile_id):
+    return os.path.join(storage.session_dir(username, time_key), PROFILE_DIR_NAME, f"{profile_id}.json")
+
+
+def list_saved(username, time_key):
+    """
+    Id các profile đã lưu của session, mới nhất trước.
+    """
+    profile_dir = os.path.join(storage.session_dir(username, time_key), PROFILE_DIR_NAME)
+    if not os.path.isdir(profile_dir):
+        return []
+    return sorted((name[: -len(".json")] for name in os.listdir(profile_dir) if name.endswith(".json")), reverse=True)
+
+
+def save(profile):
+    """
+    Ghi profile vào static/<username>/<time_key>/profiles/ (tính vào dung lượng của session).
+    """
+    if profile.username is None or profile.time_key is None:
+        return None
+    if not os.path.isdir(storage.session_dir(profile.username, profile.time_key)):
+        return None
+    path = profile_path(profile.username, profile.time_key, profile.id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile.to_dict(), f, ensure_ascii=False)
+    storage.track_files(profile.username, profile.time_key, path)
+    recent.appendleft(profile.summary())
+    return path
+
+
+def profiled(endpoint):
+    """
+    Decorator cho handler tạo voice: profile request nếu được yêu cầu, lưu kết quả và trả id qua header X-Profile-Id.
+    Handler lấy username/time_key từ form, hoặc tự gọi set_session() nếu tạo time_key bên trong.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            request = kwargs.get("request", args[0] if args else None)
+            if not is_requested(request):
+                return await func(*args, **kwargs)
+            profile = Profile(endpoint)
+            profile.username = kwargs.get("username")
+            profile.time_key = kwargs.get("time_key")
+            token = _current.set(profile)
+            task = asyncio.current_task()
+            _task_owners[task] = profile
+            profile.start()
+            try:
+                with span(endpoint):
+                    response = await func(*args, **kwargs)
+            finally:
+                profile.stop()
+                _task_owners.pop(task, None)
+                _current.reset(token)
+                path = await asyncio.to_thread(save, profile)
+            if path is not None and hasattr(response, "headers"):
+                response.headers["X-Profile-Id"] = profile.id
+            return response
+        return wrapper
+    return decorator
@@ -1,39 +1,75 @@
 from fastapi import FastAPI, Request, Form, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-import shutil
 import os
 import asyncio
 import sqlite3
 from datetime import datetime
 from starlette.middleware.sessions import SessionMiddleware
-from voicepeak_wrapper.voicepeak import Voicepeak, Narrator
+from voicepeak_wrapper.util import wav_duration_ms
+from contextlib import asynccontextmanager
 import hashlib
+import config
+import engine
+import history
+import ingest
+import profiling
+import storage
+import synthesis
+import transcode
 
 # Mount new API router for interactive line-by-line API
 from api_generate_line import router as api_generate_line_router
+from api_audio import router as api_audio_router
+from api_matrix import router as api_matrix_router
+from api_history import router as api_history_router
+from api_profiles import router as api_profiles_router
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Khởi tạo users.db khi app khởi động thay vì lúc import module
+    await asyncio.to_thread(init_db)
+    # Một client VOICEPEAK dùng chung; tải danh mục narrator và làm nóng engine trong nền (xem /readyz)
+    app.state.engine = engine.Engine()
+    warmup = asyncio.create_task(app.state.engine.start())
+    # Tìm sẵn encoder cho bản nén và thử encode một lần; encoder lỗi (thiếu codec) không được dùng
+    await transcode.probe_encoders()
+    # Chạy dọn dẹp lưu trữ định kỳ trong nền suốt vòng đời app
+    sweeper = asyncio.create_task(storage.run_sweeper())
+    trimmer = asyncio.create_task(synthesis.run_cache_trimmer())
+    yield
+    warmup.cancel()
+    sweeper.cancel()
+    trimmer.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 TEMPLATE_DIR = os.path.join(BASE_DIR, "templates")
 OUTPUT_BASE = os.path.join(BASE_DIR, "output_web")
+STATIC_DIR = config.STATIC_DIR
+DB_PATH = config.DB_PATH
 
-
-app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
+os.makedirs(STATIC_DIR, exist_ok=True)
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 templates = Jinja2Templates(directory=TEMPLATE_DIR)
 
 # Mount new API router
 app.include_router(api_generate_line_router)
+app.include_router(api_audio_router)
+app.include_router(api_matrix_router)
+app.include_router(api_history_router)
+app.include_router(api_profiles_router)
 @app.get("/voice", response_class=HTMLResponse)
 async def voice_interactive_page(request: Request):
     username = request.session.get("username")
     if not username:
         return RedirectResponse("/", status_code=303)
     is_admin = request.session.get("is_admin", False)
-    return templates.TemplateResponse("voice_interactive.html", {
+    return templates.TemplateResponse(request, "voice_interactive.html", {
         "request": request, 
         "username": username,
         "is_admin": is_admin
@@ -41,9 +77,6 @@ async def voice_interactive_page(request: Request):
 
 app.add_middleware(SessionMiddleware, secret_key="your_secret_key")
 
-STATIC_DIR = os.path.join(BASE_DIR, "static")
-DB_PATH = os.path.join(BASE_DIR, "users.db")
-
 VOICE_CHOICES = [
     "Japanese Female Child",
     "Japanese Male 3",
@@ -55,9 +88,12 @@ VOICE_CHOICES = [
 ]
 
 # Helper: get narrator/emotion list
-async def get_narrators():
-    client = Voicepeak()
-    return await client.get_narrator_list()
+async def get_narrators(request: Request):
+    # Danh mục đã tải sẵn lúc khởi động, chỉ gọi VOICEPEAK nếu chưa có
+    narrators = getattr(request.app.state, "engine", None) and request.app.state.engine.narrators
+    if not narrators:
+        narrators = await engine.get_client(request).get_narrator_list()
+    return narrators
 
 def init_db():
     conn = sqlite3.connect(DB_PATH)
@@ -76,18 +112,38 @@ def init_db():
         c.execute("INSERT INTO users (username, password, is_admin) VALUES (?, ?, 1)", ("admin", admin_pass))
     conn.commit()
     conn.close()
+    storage.init_storage_db()
+    history.init_history_db()
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: process còn chạy và nhận request
+    return JSONResponse({"status": "ok"})
+
+@app.get("/readyz")
+async def readyz(request: Request):
+    # Readiness: chỉ trả 200 khi engine đã tải danh mục narrator và làm nóng xong
+    # Lifespan chưa chạy (chưa có engine) cũng là chưa sẵn sàng
+    state = getattr(request.app.state, "engine", None)
+    if state is None:
+        return JSONResponse({"ready": False, "error": "Engine chưa khởi động."}, status_code=503)
+    status = state.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
-init_db()
+@app.get("/api/narrators")
+async def list_narrators(request: Request):
+    narrators = await get_narrators(request)
+    return JSONResponse([{"name": narrator.name, "emotions": list(narrator.emotions)} for narrator in narrators])
 
 @app.get("/", response_class=HTMLResponse)
 async def login_page(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+    return templates.TemplateResponse(request, "login.html", {"request": request})
 
 @app.post("/login", response_class=HTMLResponse)
 async def login(request: Request, username: str = Form(...), password: str = Form(...)):
     username = username.strip()
     if not username or not password:
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Vui lòng nhập đầy đủ thông tin."})
+        return templates.TemplateResponse(request, "login.html", {"request": request, "error": "Vui lòng nhập đầy đủ thông tin."})
     conn = sqlite3.connect(DB_PATH)
     c = conn.cursor()
     hashed_pass = hashlib.sha256(password.encode()).hexdigest()
@@ -99,7 +155,7 @@ async def login(request: Request, username: str = Form(...), password: str = For
         request.session["is_admin"] = bool(user[1])
         return RedirectResponse("voice", status_code=303)
     else:
-        return templates.TemplateResponse("login.html", {"request": request, "error": "Tên đăng nhập hoặc mật khẩu không đúng."})
+        return templates.TemplateResponse(request, "login.html", {"request": request, "error": "Tên đăng nhập hoặc mật khẩu không đúng."})
 
 @app.get("/admin", response_class=HTMLResponse)
 async def admin_page(request: Request):
@@ -113,13 +169,27 @@ async def admin_page(request: Request):
     c.execute("SELECT username, is_admin FROM users ORDER BY username")
     users = c.fetchall()
     conn.close()
+    usage = {
+        name: (storage.format_bytes(size), sessions) for name, (size, sessions) in storage.list_user_usage().items()
+    }
     
-    return templates.TemplateResponse("admin.html", {
+    return templates.TemplateResponse(request, "admin.html", {
         "request": request, 
         "username": username,
-        "users": users
+        "users": users,
+        "usage": usage,
+        "quota": storage.format_bytes(config.STORAGE_QUOTA_BYTES) if config.STORAGE_QUOTA_BYTES > 0 else None
     })
 
+@app.post("/admin/sweep", response_class=HTMLResponse)
+async def sweep_storage(request: Request):
+    username = request.session.get("username")
+    if not username or not request.session.get("is_admin"):
+        return RedirectResponse("/", status_code=303)
+    
+    await asyncio.to_thread(storage.sweep)
+    return RedirectResponse("../admin?success=swept", status_code=303)
+
 @app.post("/admin/add-user", response_class=HTMLResponse)
 async def add_user(request: Request, new_username: str = Form(...), new_password: str = Form(...), is_admin: int = Form(0)):
     username = request.session.get("username")
@@ -188,6 +258,7 @@ def say_text_sync(client, line, wav_path, voice):
     loop.close()
 
 @app.post("/generate", response_class=HTMLResponse)
+@profiling.profiled("/generate")
 async def generate(
     request: Request,
     voice: str = Form(...),
@@ -198,33 +269,53 @@ async def generate(
     if not username:
         return RedirectResponse("/", status_code=303)
     now_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    if not await asyncio.to_thread(storage.enforce_quota, username, now_str):
+        return HTMLResponse("Đã vượt quá dung lượng lưu trữ cho phép.", status_code=507)
     output_path = os.path.join(STATIC_DIR, username, now_str)
     os.makedirs(output_path, exist_ok=True)
-    if text_file:
-        file_path = os.path.join(output_path, text_file.filename)
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(text_file.file, f)
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = [line.strip() for line in f if line.strip()]
+    profiling.set_session(username, now_str)
+    # Đọc script dạng luồng: tạo voice ngay từ những dòng đầu, không nạp cả file vào bộ nhớ
+    if text_file and text_file.filename:
+        # Bản sao file upload được ghi cùng lúc với voice_lines.txt, text_NN.txt: đặt tên riêng để không trùng
+        file_path = os.path.join(output_path, f"source_{os.path.basename(text_file.filename)}")
+        lines = ingest.iter_lines(ingest.iter_upload(text_file, copy_to=file_path))
     else:
-        lines = [line.strip() for line in text_content.splitlines() if line.strip()]
-    client = Voicepeak()
+        file_path = None
+        lines = ingest.iter_lines(ingest.iter_text(text_content))
+    client = engine.get_client(request)
     output_txt_path = os.path.join(output_path, "voice_lines.txt")
+    idx = 0
+    failed = 0
+    duration_ms = 0
     with open(output_txt_path, "w", encoding="utf-8") as txt_out:
-        for idx, line in enumerate(lines):
+        async for line in lines:
             wav_path = os.path.join(output_path, f"voice_{idx}.wav")
             txt_path = os.path.join(output_path, f"text_{idx:02d}.txt")
             txt_out.write(f"{idx}: {line}\n")
             with open(txt_path, "w", encoding="utf-8") as single_txt:
                 single_txt.write(line)
             try:
-                await asyncio.to_thread(say_text_sync, client, line, wav_path, voice)
+                await synthesis.render(client, line, voice, wav_path)
             except Exception as e:
                 error_log = os.path.join(output_path, "error.log")
                 with open(error_log, "a", encoding="utf-8") as err_file:
                     err_file.write(f"Lỗi tạo voice cho dòng {idx}: {line}\n{str(e)}\n")
+                await asyncio.to_thread(storage.track_files, username, now_str, error_log)
+                failed += 1
+            else:
+                duration_ms += await asyncio.to_thread(wav_duration_ms, wav_path)
+                await asyncio.to_thread(history.record_line, username, now_str, voice, idx)
+            await asyncio.to_thread(storage.track_files, username, now_str, txt_path, wav_path)
+            idx += 1
+    tracked = [output_txt_path] + ([file_path] if file_path else [])
+    await asyncio.to_thread(storage.track_files, username, now_str, *tracked)
+    await asyncio.to_thread(
+        history.finish_session, username, now_str,
+        history.STATUS_FAILED if failed else history.STATUS_COMPLETED,
+        line_count=idx, total_duration=duration_ms / 1000, voice=voice
+    )
     # Trả về thông báo thành công, không render danh sách file
-    return templates.TemplateResponse("success.html", {
+    return templates.TemplateResponse(request, "success.html", {
         "request": request,
         "output_path": output_path,
         "username": username,
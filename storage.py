@@ -0,0 +1,285 @@
+import asyncio
+import os
+import shutil
+import time
+
+import config
+import db
+import history
+
+# Kế toán dung lượng theo user/session, cập nhật dần mỗi lần ghi file thay vì duyệt lại static/.
+# storage_files giữ kích thước từng file để tính chênh lệch khi file bị ghi đè (tạo lại một dòng),
+# storage_sessions cộng dồn theo session và giữ last_access cho chính sách LRU.
+
+
+def init_storage_db():
+    """
+    Tạo bảng kế toán dung lượng. Lần đầu tạo bảng sẽ quét static/ một lần để nhập các session cũ.
+    """
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='storage_sessions'")
+    is_new = c.fetchone() is None
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS storage_files (
+            username TEXT NOT NULL,
+            time_key TEXT NOT NULL,
+            name TEXT NOT NULL,
+            bytes INTEGER NOT NULL,
+            PRIMARY KEY (username, time_key, name)
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS storage_sessions (
+            username TEXT NOT NULL,
+            time_key TEXT NOT NULL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            last_access REAL NOT NULL,
+            PRIMARY KEY (username, time_key)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_storage_sessions_access ON storage_sessions (last_access)")
+    conn.close()
+    if is_new:
+        rebuild_index()
+
+
+def rebuild_index():
+    """
+    Quét lại toàn bộ static/<username>/<time_key>/ và ghi đè bảng kế toán. Chỉ dùng khi khởi tạo/khôi phục.
+    """
+    with db.transaction() as c:
+        c.execute("DELETE FROM storage_files")
+        c.execute("DELETE FROM storage_sessions")
+        if not os.path.isdir(config.STATIC_DIR):
+            return
+        for username in os.listdir(config.STATIC_DIR):
+            user_path = os.path.join(config.STATIC_DIR, username)
+            if not os.path.isdir(user_path):
+                continue
+            for time_key in os.listdir(user_path):
+                session_path = os.path.join(user_path, time_key)
+                if not os.path.isdir(session_path):
+                    continue
+                total = 0
+                for root, dirs, files in os.walk(session_path):
+                    for file in files:
+                        file_path = os.path.join(root, file)
+                        size = os.path.getsize(file_path)
+                        total += size
+                        c.execute(
+                            "INSERT INTO storage_files (username, time_key, name, bytes) VALUES (?, ?, ?, ?)",
+                            (username, time_key, os.path.relpath(file_path, session_path), size),
+                        )
+                c.execute(
+                    "INSERT INTO storage_sessions (username, time_key, bytes, last_access) VALUES (?, ?, ?, ?)",
+                    (username, time_key, total, os.path.getmtime(session_path)),
+                )
+
+
+def session_dir(username, time_key):
+    return os.path.join(config.STATIC_DIR, username, time_key)
+
+
+def is_session_dir(username, time_key):
+    """
+    True nếu static/username/time_key (sau khi giải symlink và "..") đúng là thư mục cấp hai trong static/.
+    """
+    root = os.path.realpath(config.STATIC_DIR)
+    return os.path.dirname(os.path.dirname(os.path.realpath(session_dir(username, time_key)))) == root
+
+
+def is_inside(path, base):
+    base = os.path.realpath(base)
+    return os.path.commonpath([base, os.path.realpath(path)]) == base
+
+
+def track_files(username, time_key, *paths):
+    """
+    Cập nhật dung lượng sau khi ghi (hoặc xóa) các file paths thuộc session username/time_key.
+    """
+    base = session_dir(username, time_key)
+    if not is_session_dir(username, time_key) or not all(is_inside(path, base) for path in paths):
+        raise ValueError(f"Đường dẫn nằm ngoài thư mục session: {username}/{time_key}")
+    sizes = [(os.path.relpath(path, base), os.path.getsize(path) if os.path.exists(path) else 0) for path in paths]
+    with db.transaction() as c:
+        delta = 0
+        for name, size in sizes:
+            c.execute(
+                "SELECT bytes FROM storage_files WHERE username=? AND time_key=? AND name=?", (username, time_key, name)
+            )
+            row = c.fetchone()
+            delta += size - (row[0] if row else 0)
+            c.execute(
+                "INSERT OR REPLACE INTO storage_files (username, time_key, name, bytes) VALUES (?, ?, ?, ?)",
+                (username, time_key, name, size),
+            )
+        c.execute(
+            """
+            INSERT INTO storage_sessions (username, time_key, bytes, last_access) VALUES (?, ?, ?, ?)
+            ON CONFLICT (username, time_key) DO UPDATE
+            SET bytes = bytes + excluded.bytes, last_access = excluded.last_access
+            """,
+            (username, time_key, delta, time.time()),
+        )
+        history.sync_byte_size(c, username, time_key)
+
+
+# Lần cuối cập nhật last_access của từng session do nghe audio, để không ghi DB ở mọi request
+_last_touch = dict()
+LAST_TOUCH_MAX_ENTRIES = 10000
+
+
+def access_due(username, time_key, now=None):
+    """
+    True nếu lượt nghe này nên cập nhật last_access (lần cập nhật trước đã quá ACCESS_TOUCH_INTERVAL_SECONDS).
+    """
+    now = now or time.time()
+    if now - _last_touch.get((username, time_key), 0) < config.ACCESS_TOUCH_INTERVAL_SECONDS:
+        return False
+    _last_touch[(username, time_key)] = now
+    if len(_last_touch) > LAST_TOUCH_MAX_ENTRIES:
+        for key, touched in list(_last_touch.items()):
+            if now - touched >= config.ACCESS_TOUCH_INTERVAL_SECONDS:
+                del _last_touch[key]
+    return True
+
+
+def touch_session(username, time_key):
+    _last_touch[(username, time_key)] = time.time()
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute(
+        "UPDATE storage_sessions SET last_access=? WHERE username=? AND time_key=?", (time.time(), username, time_key)
+    )
+    conn.close()
+
+
+def get_user_usage(username):
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute("SELECT COALESCE(SUM(bytes), 0) FROM storage_sessions WHERE username=?", (username,))
+    usage = c.fetchone()[0]
+    conn.close()
+    return usage
+
+
+def list_user_usage():
+    """
+    Trả về dict {username: (tổng byte, số session)}
+    """
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute("SELECT username, SUM(bytes), COUNT(*) FROM storage_sessions GROUP BY username")
+    usage = {row[0]: (row[1], row[2]) for row in c.fetchall()}
+    conn.close()
+    return usage
+
+
+def evict_session(username, time_key):
+    _last_touch.pop((username, time_key), None)
+    # Không bao giờ xóa thư mục ngoài static/<user>/<time_key> (kể cả khi DB có bản ghi với tên như "..")
+    if is_session_dir(username, time_key):
+        shutil.rmtree(session_dir(username, time_key), ignore_errors=True)
+    else:
+        print(f"Bỏ qua xóa thư mục ngoài static/: {username}/{time_key}")
+    with db.transaction() as c:
+        c.execute("DELETE FROM storage_files WHERE username=? AND time_key=?", (username, time_key))
+        c.execute("DELETE FROM storage_sessions WHERE username=? AND time_key=?", (username, time_key))
+        history.mark_evicted(c, username, time_key)
+
+
+def enforce_quota(username, keep_time_key=None, active_since=None):
+    """
+    Xóa các session ít được dùng gần đây nhất của user cho tới khi dưới quota.
+    Session keep_time_key (đang tạo) và các session được ghi/nghe hoặc còn đang tạo từ thời điểm active_since
+    (mặc định SWEEP_ACTIVE_SECONDS trước) không bị xóa: tab khác, /generate hay stream đang chạy không mất file.
+    Trả về True nếu user còn dưới quota.
+    """
+    quota = config.STORAGE_QUOTA_BYTES
+    if quota <= 0:
+        return True
+    usage = get_user_usage(username)
+    if usage < quota:
+        return True
+    conn = db.connect()
+    c = conn.cursor()
+    c.execute(
+        "SELECT time_key, bytes, last_access FROM storage_sessions WHERE username=? AND time_key != ? "
+        "ORDER BY last_access",
+        (username, keep_time_key or ""),
+    )
+    candidates = c.fetchall()
+    conn.close()
+    if active_since is None:
+        active_since = time.time() - config.SWEEP_ACTIVE_SECONDS
+    active = history.active_time_keys(username, active_since)
+    candidates = [
+        (time_key, size) for time_key, size, last_access in candidates
+        if last_access < active_since and time_key not in active
+    ]
+    for time_key, size in candidates:
+        if usage < quota:
+            break
+        evict_session(username, time_key)
+        usage -= size
+    return usage < quota
+
+
+def sweep_zip_archives(now=None):
+    now = now or time.time()
+    removed = 0
+    if not os.path.isdir(config.ZIP_DIR):
+        return removed
+    for entry in os.scandir(config.ZIP_DIR):
+        if entry.is_file() and now - entry.stat().st_mtime > config.ZIP_RETENTION_SECONDS:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def sweep(now=None):
+    """
+    Một lượt dọn dẹp: xóa session quá hạn lưu trữ, ép quota theo LRU và xóa file zip tạm cũ.
+    Khi ép quota không đụng tới session đang được tạo hoặc vừa được dùng (SWEEP_ACTIVE_SECONDS).
+    """
+    now = now or time.time()
+    evicted = 0
+    conn = db.connect()
+    c = conn.cursor()
+    if config.SESSION_RETENTION_SECONDS > 0:
+        c.execute(
+            "SELECT username, time_key FROM storage_sessions WHERE last_access < ?",
+            (now - config.SESSION_RETENTION_SECONDS,),
+        )
+        expired = c.fetchall()
+    else:
+        expired = []
+    conn.close()
+    for username, time_key in expired:
+        evict_session(username, time_key)
+        evicted += 1
+    if config.STORAGE_QUOTA_BYTES > 0:
+        for username in list_user_usage():
+            enforce_quota(username, active_since=now - config.SWEEP_ACTIVE_SECONDS)
+    return {"evicted_sessions": evicted, "removed_archives": sweep_zip_archives(now)}
+
+
+async def run_sweeper(interval=None):
+    interval = interval or config.SWEEP_INTERVAL_SECONDS
+    while True:
+        try:
+            await asyncio.to_thread(sweep)
+        except Exception as e:
+            print(f"Lỗi khi dọn dẹp lưu trữ: {e}")
+        await asyncio.sleep(interval)
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import config
+import profiling
+from voicepeak_wrapper.util import say_text_sync
+
+# Cache kết quả tổng hợp giọng theo nội dung (voice + text): cùng một dòng chỉ gọi VOICEPEAK một lần,
+# các lần sau chỉ copy file. Việc tạo trước (speculative) khi người dùng đang gõ cũng đi qua cache này,
+# nên khi bấm "Tạo voice" phần lớn các dòng đã có sẵn.
+
+_inflight: dict[str, asyncio.Task] = dict()
+_foreground = 0
+_idle = asyncio.Event()
+_idle.set()
+
+
+def cache_key(voice, text):
+    return hashlib.sha256(json.dumps([voice, text], ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def cache_path(key):
+    return os.path.join(config.SYNTH_CACHE_DIR, key[:2], f"{key}.wav")
+
+
+def lookup(key):
+    """
+    Trả về đường dẫn file trong cache (và cập nhật mtime cho LRU) hoặc None nếu chưa có.
+    """
+    path = cache_path(key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+async def _render_to_cache(client, key, text, voice):
+    path = cache_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{id(asyncio.current_task())}.tmp.wav"
+    try:
+        with profiling.span("synthesis.engine", voice=voice, chars=len(text)):
+            await asyncio.to_thread(profiling.traced("say_text_sync", say_text_sync), client, text, tmp_path, voice)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+@contextmanager
+def foreground():
+    """
+    Đánh dấu đang có việc tạo voice người dùng chờ: các dòng nháp (speculative) chưa chạy sẽ nhường.
+    """
+    global _foreground
+    _foreground += 1
+    _idle.clear()
+    try:
+        yield
+    finally:
+        _foreground -= 1
+        if _foreground == 0:
+            _idle.set()
+
+
+async def render(client, text, voice, dest=None, speculative=False):
+    """
+    Tạo voice cho text qua cache rồi copy ra dest (nếu có).
+    Nếu cùng dòng đang được tạo (ví dụ bởi lượt tạo trước) thì chờ kết quả đó thay vì gọi VOICEPEAK lần nữa.
+    """
+    if speculative:
+        return await _render(client, text, voice, dest)
+    with foreground():
+        return await _render(client, text, voice, dest)
+
+
+async def _render(client, text, voice, dest):
+    key = cache_key(voice, text)
+    with profiling.span("synthesis.lookup"):
+        path = await asyncio.to_thread(lookup, key)
+    if path is None:
+        task = _inflight.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.get_running_loop().create_task(_render_to_cache(client, key, text, voice))
+            _inflight[key] = task
+            task.add_done_callback(lambda _: _inflight.pop(key, None))
+        # shield: hủy một lượt chờ (ví dụ dòng nháp bị sửa) không làm hủy lượt tạo mà người khác đang chờ
+        with profiling.span("synthesis.wait", shared=shared):
+            path = await asyncio.shield(task)
+    if dest is not None:
+        with profiling.span("synthesis.copy"):
+            await asyncio.to_thread(shutil.copyfile, path, dest)
+    return key
+
+
+class DraftRenderer:
+    """
+    Tạo trước các dòng đã gõ xong trong trình soạn thảo, với độ ưu tiên thấp:
+    chỉ chạy khi không có request tạo voice nào đang chờ, tối đa config.SPECULATIVE_WORKERS dòng cùng lúc.
+    Dòng bị sửa hoặc xóa trong bản nháp mới sẽ bị hủy nếu chưa bắt đầu tạo.
+    Tổng số dòng chờ của mọi user không vượt quá config.SPECULATIVE_MAX_PENDING.
+    """
+
+    def __init__(self):
+        self._jobs: dict[str, dict[str, asyncio.Task]] = dict()
+        self._slots = None
+
+    def update(self, client, username, voice, lines):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(config.SPECULATIVE_WORKERS)
+        wanted = {cache_key(voice, line): line for line in lines[: config.SPECULATIVE_MAX_LINES]}
+        jobs = self._jobs.setdefault(username, dict())
+        cancelled = 0
+        for key, job in list(jobs.items()):
+            if key not in wanted:
+                if not job.done():
+                    job.cancel()
+                    cancelled += 1
+                del jobs[key]
+        queued = 0
+        cached = 0
+        skipped = 0
+        pending = self.pending()
+        for key, line in wanted.items():
+            if key in jobs:
+                continue
+            if os.path.exists(cache_path(key)):
+                cached += 1
+                continue
+            if pending >= config.SPECULATIVE_MAX_PENDING:
+                skipped += 1
+                continue
+            job = asyncio.get_running_loop().create_task(self._speculate(client, line, voice))
+            job.add_done_callback(lambda done, key=key: self._forget(username, key, done))
+            jobs[key] = job
+            queued += 1
+            pending += 1
+        result = {"queued": queued, "cancelled": cancelled, "cached": cached, "skipped": skipped, "pending": len(jobs)}
+        if not jobs:
+            del self._jobs[username]
+        return result
+
+    def pending(self):
+        return sum(len(jobs) for jobs in self._jobs.values())
+
+    def _forget(self, username, key, job):
+        jobs = self._jobs.get(username)
+        if jobs is None or jobs.get(key) is not job:
+            return
+        del jobs[key]
+        if not jobs:
+            del self._jobs[username]
+
+    async def _speculate(self, client, line, voice):
+        async with self._slots:
+            await _idle.wait()
+            try:
+                await render(client, line, voice, speculative=True)
+            except asyncio.CancelledError:
+                # Hủy chỉ dừng lượt chờ (shield), tiến trình VOICEPEAK vẫn chạy tới hết:
+                # giữ slot cho tới khi nó xong để số tiến trình nháp không vượt SPECULATIVE_WORKERS
+                task = _inflight.get(cache_key(voice, line))
+                if task is not None:
+                    await asyncio.wait([task])
+                raise
+            except Exception:
+                # Lỗi của dòng nháp sẽ được báo lại khi người dùng thực sự gửi dòng đó
+                pass
+
+
+def trim_cache():
+    """
+    Xóa các file ít dùng nhất trong cache cho tới khi dưới config.SYNTH_CACHE_MAX_BYTES.
+    """
+    if not os.path.isdir(config.SYNTH_CACHE_DIR):
+        return 0
+    entries = list()
+    total = 0
+    for root, dirs, files in os.walk(config.SYNTH_CACHE_DIR):
+        for file in files:
+            path = os.path.join(root, file)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    removed = 0
+    for mtime, size, path in sorted(entries):
+        if total <= config.SYNTH_CACHE_MAX_BYTES:
+            break
+        # File .tmp.wav đang được ghi dở không bị xóa
+        if path.endswith(".tmp.wav") and time.time() - mtime < 3600:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+async def run_cache_trimmer(interval=None):
+    interval = interval or config.SWEEP_INTERVAL_SECONDS
+    while True:
+        try:
+            await asyncio.to_thread(trim_cache)
+        except Exception as e:
+            print(f"Lỗi khi dọn cache tổng hợp giọng: {e}")
+        await asyncio.sleep(interval)
+
+
+drafts = DraftRenderer()
@@ -0,0 +1,81 @@
+import os
+
+import httpx
+import pytest
+from fastapi import FastAPI, Form, Request
+from starlette.middleware.sessions import SessionMiddleware
+
+import config
+import history
+import storage
+import stub_voicepeak
+
+# Các router chép config.STATIC_DIR thành hằng số lúc import
+STATIC_DIR_MODULES = ("api_audio", "api_generate_line", "api_matrix")
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """
+    static/, users.db (đủ bảng kế toán lưu trữ và lịch sử), thư mục zip và cache riêng cho từng test.
+    Trả về đường dẫn static/.
+    """
+    static_dir = str(tmp_path / "static")
+    monkeypatch.setattr(config, "STATIC_DIR", static_dir)
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "users.db"))
+    monkeypatch.setattr(config, "ZIP_DIR", str(tmp_path / "zip"))
+    monkeypatch.setattr(config, "SYNTH_CACHE_DIR", str(tmp_path / "cache"))
+    for module in STATIC_DIR_MODULES:
+        monkeypatch.setattr(f"{module}.STATIC_DIR", static_dir)
+    monkeypatch.setattr(storage, "_last_touch", dict())
+    os.makedirs(static_dir)
+    storage.init_storage_db()
+    history.init_history_db()
+    return static_dir
+
+
+@pytest.fixture
+def stub_exe(tmp_path, monkeypatch):
+    """
+    Engine VOICEPEAK giả lập (test/stub_voicepeak.py), cũng được đặt làm config.VOICEPEAK_EXE.
+    """
+    if os.name != "posix":
+        pytest.skip("stub engine cần /bin/sh")
+    exe_path = stub_voicepeak.make_stub_executable(str(tmp_path))
+    monkeypatch.setattr(config, "VOICEPEAK_EXE", exe_path)
+    return exe_path
+
+
+@pytest.fixture
+def stub_client(stub_exe):
+    import voicepeak_wrapper
+
+    return voicepeak_wrapper.Voicepeak(stub_exe)
+
+
+@pytest.fixture
+def make_client(db):
+    """
+    Tạo httpx.AsyncClient gọi app chỉ gồm các router cần test (có SessionMiddleware).
+    Đăng nhập bằng login(client, username, is_admin).
+    """
+    def build(*routers):
+        app = FastAPI()
+
+        @app.post("/test-login")
+        async def test_login(request: Request, username: str = Form(...), is_admin: int = Form(0)):
+            request.session["username"] = username
+            request.session["is_admin"] = bool(is_admin)
+            return {"username": username}
+
+        for router in routers:
+            app.include_router(router)
+        app.add_middleware(SessionMiddleware, secret_key="test")
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    return build
+
+
+async def login(client, username, is_admin=False):
+    response = await client.post("/test-login", data={"username": username, "is_admin": int(is_admin)})
+    assert response.status_code == 200
@@ -0,0 +1,101 @@
+# Copyright (c) 2023 Nanahuse
+# This software is released under the MIT License
+# https://opensource.org/license/mit/
+
+"""
+Engine VOICEPEAK giả lập dùng cho benchmark và test trên Linux (không cần cài VOICEPEAK, không cần mạng).
+
+Nhận cùng tham số dòng lệnh với voicepeak.exe mà Voicepeak gửi xuống và ghi ra file wav im lặng
+có độ dài tỉ lệ với số ký tự. Có thể mô phỏng độ trễ của engine thật bằng biến môi trường
+STUB_VOICEPEAK_DELAY (giây).
+"""
+
+import os
+import stat
+import sys
+import time
+import wave
+
+NARRATORS = {
+    "Japanese Female Child": ("happy", "sad", "angry", "fun"),
+    "Japanese Male 1": ("happy", "sad", "angry", "fun"),
+    "Japanese Male 2": ("happy", "sad", "angry", "fun"),
+    "Japanese Male 3": ("happy", "sad", "angry", "fun"),
+    "Japanese Female 1": ("happy", "sad", "angry", "fun"),
+    "Japanese Female 2": ("happy", "sad", "angry", "fun"),
+    "Japanese Female 3": ("happy", "sad", "angry", "fun"),
+}
+SAMPLE_RATE = 48000
+MS_PER_CHAR = 80
+MAX_TEXT_LENGTH = 140
+
+
+def write_silence(path: str, duration_ms: int, sample_rate: int = SAMPLE_RATE):
+    frames = int(sample_rate * duration_ms / 1000)
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * frames)
+
+
+def make_stub_executable(directory: str) -> str:
+    """
+    Tạo shim thực thi được để truyền vào Voicepeak(exe_path=...), chạy stub này bằng interpreter hiện tại.
+    """
+    path = os.path.join(directory, "voicepeak")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" "$@"\n')
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def main(argv: list[str]) -> int:
+    options = dict()
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in ("-s", "-t", "-o", "-n", "-e", "--speed", "--pitch", "--list-emotion") and i + 1 < len(argv):
+            options[arg] = argv[i + 1]
+            i += 2
+        else:
+            options[arg] = None
+            i += 1
+
+    delay = float(os.environ.get("STUB_VOICEPEAK_DELAY", "0"))
+    if delay > 0:
+        time.sleep(delay)
+
+    if "--list-narrator" in options:
+        sys.stdout.write("\n".join(NARRATORS))
+        return 0
+
+    if "--list-emotion" in options:
+        name = options["--list-emotion"]
+        if name not in NARRATORS:
+            sys.stderr.write(f"narrator not found: {name}")
+            return 1
+        sys.stdout.write("\n".join(NARRATORS[name]))
+        return 0
+
+    if "-t" in options:
+        with open(options["-t"], encoding="utf-8") as f:
+            text = f.read()
+    else:
+        text = options.get("-s") or ""
+
+    if len(text) > MAX_TEXT_LENGTH:
+        sys.stderr.write("text is too long")
+        return 1
+
+    narrator = options.get("-n")
+    if narrator is not None and narrator not in NARRATORS:
+        sys.stderr.write(f"narrator not found: {narrator}")
+        return 1
+
+    write_silence(options.get("-o") or "output.wav", max(len(text), 1) * MS_PER_CHAR)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import api_audio
+import db as db_module
+import storage
+
+ACCEPT_WAV = {"Accept": "audio/wav"}
+
+
+@pytest.fixture
+def client(db):
+    session_path = storage.session_dir("alice", "s1")
+    os.makedirs(session_path)
+    with open(os.path.join(session_path, "00.wav"), "wb") as f:
+        f.write(bytes(range(256)) * 4)
+    app = FastAPI()
+    app.include_router(api_audio.router)
+    return TestClient(app)
+
+
+def test_etag_and_conditional_get(client):
+    response = client.get("/audio/alice/s1/00.wav", headers=ACCEPT_WAV)
+    assert response.status_code == 200 and len(response.content) == 1024
+    etag = response.headers["etag"]
+    assert not etag.startswith("W/")
+    assert response.headers["cache-control"] == api_audio.REVALIDATE_CACHE_CONTROL
+
+    response = client.get("/audio/alice/s1/00.wav", headers={**ACCEPT_WAV, "If-None-Match": f'"x", W/{etag}'})
+    assert response.status_code == 304 and response.content == b""
+    assert response.headers["etag"] == etag
+
+    response = client.head("/audio/alice/s1/00.wav", headers=ACCEPT_WAV)
+    assert response.status_code == 200 and response.headers["content-length"] == "1024"
+
+
+def test_range_and_if_range(client):
+    response = client.get("/audio/alice/s1/00.wav", headers={**ACCEPT_WAV, "Range": "bytes=256-511"})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == "bytes 256-511/1024"
+    assert response.content == bytes(range(256))
+    etag = response.headers["etag"]
+
+    response = client.get("/audio/alice/s1/00.wav", headers={**ACCEPT_WAV, "Range": "bytes=0-9", "If-Range": etag})
+    assert response.status_code == 206
+    # ETag cũ (file đã bị tạo lại) -> trả cả file
+    response = client.get("/audio/alice/s1/00.wav", headers={**ACCEPT_WAV, "Range": "bytes=0-9", "If-Range": '"x"'})
+    assert response.status_code == 200 and len(response.content) == 1024
+
+
+@pytest.mark.asyncio
+async def test_versioned_url_is_immutable(client):
+    url = await api_audio.audio_url("alice", "s1", "00.wav")
+    response = client.get(f"/{url}", headers=ACCEPT_WAV)
+    assert response.headers["cache-control"] == api_audio.IMMUTABLE_CACHE_CONTROL
+
+    # Tạo lại dòng: URL cũ không còn được cache vĩnh viễn, ETag đổi theo nội dung
+    wav_path = os.path.join(storage.session_dir("alice", "s1"), "00.wav")
+    with open(wav_path, "wb") as f:
+        f.write(b"\x00" * 1024)
+    os.utime(wav_path, (1, 1))
+    response = client.get(f"/{url}", headers=ACCEPT_WAV)
+    assert response.headers["cache-control"] == api_audio.REVALIDATE_CACHE_CONTROL
+    version = response.headers["etag"].strip('"')
+    assert await api_audio.audio_url("alice", "s1", "00.wav") == f"audio/alice/s1/00.wav?v={version}"
+
+
+def test_listening_updates_last_access(client):
+    storage.track_files("alice", "s1", os.path.join(storage.session_dir("alice", "s1"), "00.wav"))
+    conn = db_module.connect()
+    conn.execute("UPDATE storage_sessions SET last_access=0")
+    client.get("/audio/alice/s1/00.wav", headers=ACCEPT_WAV)
+    assert conn.execute("SELECT last_access FROM storage_sessions").fetchone()[0] > 0
+
+    # Trong ACCESS_TOUCH_INTERVAL_SECONDS không ghi lại DB
+    conn.execute("UPDATE storage_sessions SET last_access=0")
+    client.get("/audio/alice/s1/00.wav", headers=ACCEPT_WAV)
+    assert conn.execute("SELECT last_access FROM storage_sessions").fetchone()[0] == 0
+    conn.close()
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+import config
+import engine
+import stub_voicepeak
+
+
+@pytest.mark.asyncio
+async def test_start_warms_configured_narrators(stub_exe, monkeypatch):
+    monkeypatch.setattr(config, "WARMUP_NARRATORS", ["Japanese Male 1", "Japanese Female 1"])
+    state = engine.Engine(stub_exe)
+    assert not state.ready
+    await state.start()
+    status = state.status()
+    assert status["ready"] and status["error"] is None
+    assert status["narrators"] == len(stub_voicepeak.NARRATORS)
+    assert status["warmed"] == ["Japanese Male 1", "Japanese Female 1"]
+
+
+@pytest.mark.asyncio
+async def test_start_reports_errors(stub_exe, tmp_path, monkeypatch):
+    state = engine.Engine(str(tmp_path / "missing"))
+    await state.start()
+    assert not state.ready and state.error
+
+
+@pytest.mark.asyncio
+async def test_start_retries_with_backoff(stub_exe, monkeypatch):
+    monkeypatch.setattr(config, "ENGINE_RETRY_SECONDS", 0.01)
+    monkeypatch.setattr(config, "WARMUP_NARRATORS", ["hogehoge"])
+    state = engine.Engine(stub_exe)
+    task = asyncio.create_task(state.start())
+
+    async def retried():
+        while state.attempts < 3:
+            await asyncio.sleep(0.05)
+
+    await asyncio.wait_for(retried(), timeout=10)
+    # Không narrator nào làm nóng được: chưa sẵn sàng nhưng vẫn đang thử lại
+    assert not state.ready and "hogehoge" in state.error
+    task.cancel()
+
+    # Danh mục narrator lỗi ở lần đầu -> lần thử lại thành công
+    monkeypatch.setattr(config, "WARMUP_NARRATORS", ["Japanese Male 1"])
+    state = engine.Engine(stub_exe)
+    get_narrator_list = state.client.get_narrator_list
+    calls = list()
+
+    async def flaky_narrator_list():
+        calls.append(1)
+        if len(calls) == 1:
+            raise RuntimeError("engine chưa sẵn sàng")
+        return await get_narrator_list()
+
+    monkeypatch.setattr(state.client, "get_narrator_list", flaky_narrator_list)
+    await asyncio.wait_for(state.start(), timeout=5)
+    assert state.ready and state.error is None and state.attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_up_skips_bad_narrator(stub_exe, monkeypatch):
+    monkeypatch.setattr(config, "WARMUP_NARRATORS", ["hogehoge", "Japanese Male 1"])
+    state = engine.Engine(stub_exe)
+    await state.start()
+    status = state.status()
+    assert status["ready"] and status["warmed"] == ["Japanese Male 1"] and status["warm_failed"] == ["hogehoge"]
+
+
+@pytest.mark.asyncio
+async def test_readyz_before_lifespan():
+    import httpx
+    import server
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        assert (await client.get("/healthz")).status_code == 200
+        response = await client.get("/readyz")
+    assert response.status_code == 503 and response.json()["ready"] is False
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import os
+from urllib.parse import urlencode
+
+import pytest
+from fastapi import FastAPI
+
+import api_generate_line
+import config
+import ingest
+import storage
+import synthesis
+from conftest import login
+
+PARAMS = {"username": "alice", "voice": "Japanese Male 1", "time_key": "s1", "encoding": "utf-8"}
+# iter_lines gom SNIFF_BYTES đầu tiên để đoán encoding: gửi trước một khối dòng trống cho đủ
+PADDING = b"\n" * ingest.SNIFF_BYTES
+
+
+def script_lines(count):
+    return [f"本日は晴天なり {idx:02d}" for idx in range(count)]
+
+
+def rendered_count():
+    session_path = storage.session_dir("alice", "s1")
+    if not os.path.isdir(session_path):
+        return 0
+    return sum(1 for name in os.listdir(session_path) if name.endswith(".wav"))
+
+
+def parse_ndjson(body):
+    assert body.endswith("\n")
+    return [json.loads(line) for line in body.splitlines()]
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_ndjson(make_client, stub_exe):
+    lines = script_lines(3)
+
+    async def body():
+        yield PADDING
+        # Dòng bị cắt giữa hai chunk (kể cả giữa một ký tự UTF-8) vẫn được ghép lại
+        data = "\n".join(lines).encode()
+        for start in range(0, len(data), 7):
+            yield data[start:start + 7]
+
+    async with make_client(api_generate_line.router) as client:
+        await login(client, "alice")
+        response = await client.post("/api/generate-stream", params=PARAMS, content=body())
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    records = parse_ndjson(response.text)
+    assert records[-1] == {"done": True, "total_lines": 3}
+    assert [(record["index"], record["text"]) for record in records[:-1]] == list(enumerate(lines))
+    assert all("error" not in record and record["audio_url"].startswith("audio/alice/s1/") for record in records[:-1])
+    assert rendered_count() == 3
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_back_pressure(make_client, stub_exe, monkeypatch):
+    monkeypatch.setattr(config, "INGEST_QUEUE_LINES", 1)
+    monkeypatch.setenv("STUB_VOICEPEAK_DELAY", "0.05")
+    lines = script_lines(12)
+    lags = list()
+
+    async def body():
+        yield PADDING
+        for idx, line in enumerate(lines):
+            # Số dòng server đã nhận nhưng chưa tạo xong không vượt quá hàng đợi (+ dòng đang tạo)
+            lags.append(idx - rendered_count())
+            yield f"{line}\n".encode()
+
+    async with make_client(api_generate_line.router) as client:
+        await login(client, "alice")
+        response = await client.post("/api/generate-stream", params=PARAMS, content=body())
+    assert parse_ndjson(response.text)[-1] == {"done": True, "total_lines": 12}
+    assert max(lags) <= config.INGEST_QUEUE_LINES + 3
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_client_disconnect(db, stub_exe):
+    # Gọi ASGI trực tiếp để ngắt kết nối giữa chừng khi body mới gửi được 2 dòng
+    app = FastAPI()
+    app.include_router(api_generate_line.router)
+
+    async def logged_in_app(scope, receive, send):
+        scope["session"] = {"username": "alice"}
+        await app(scope, receive, send)
+
+    chunks = [PADDING] + [f"{line}\n".encode() for line in script_lines(2)]
+    sent = list()
+
+    async def receive():
+        if chunks:
+            return {"type": "http.request", "body": chunks.pop(0), "more_body": True}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/api/generate-stream",
+        "raw_path": b"/api/generate-stream",
+        "root_path": "",
+        "query_string": urlencode(PARAMS).encode(),
+        "headers": [(b"content-type", b"text/plain")],
+        "client": ("test", 1),
+        "server": ("test", 80),
+    }
+    await asyncio.wait_for(logged_in_app(scope, receive, send), timeout=10)
+
+    assert sent[0]["status"] == 200
+    body = b"".join(message.get("body", b"") for message in sent[1:]).decode()
+    records = parse_ndjson(body)
+    # Các dòng đã nhận đủ vẫn được tạo, dòng cuối báo lỗi thay vì treo hoặc im lặng kết thúc
+    assert [record["index"] for record in records[:-1]] == [0, 1]
+    assert records[-1]["done"] and records[-1]["total_lines"] == 2 and "error" in records[-1]
+    assert rendered_count() == 2
+
+
+@pytest.mark.asyncio
+async def test_generate_stream_requires_session(make_client, stub_exe):
+    async with make_client(api_generate_line.router) as client:
+        response = await client.post("/api/generate-stream", params=PARAMS, content=b"x\n")
+        assert response.status_code == 401
+        await login(client, "bob")
+        response = await client.post("/api/generate-stream", params=PARAMS, content=b"x\n")
+        assert response.status_code == 403
+        await login(client, "alice")
+        response = await client.post(
+            "/api/generate-stream", params={**PARAMS, "time_key": ".."}, content=b"x\n"
+        )
+        assert response.status_code == 400
+    assert rendered_count() == 0
+
+
+@pytest.mark.asyncio
+async def test_draft_requires_session(make_client, stub_exe, monkeypatch):
+    monkeypatch.setattr(synthesis, "drafts", synthesis.DraftRenderer())
+    form = {"username": "bob", "voice": "Japanese Male 1", "text": "一行目\n"}
+    async with make_client(api_generate_line.router) as client:
+        assert (await client.post("/api/draft", data=form)).status_code == 401
+
+        # username trong form bị bỏ qua: job luôn thuộc user của session
+        await login(client, "alice")
+        response = await client.post("/api/draft", data=form)
+    assert response.status_code == 200 and response.json()["queued"] == 1
+    assert list(synthesis.drafts._jobs) == ["alice"]
+    synthesis.drafts.update(None, "alice", "Japanese Male 1", [])
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("username, time_key", [("mallory", "../../precious"), ("mallory", ".."), ("..", "s1")])
+async def test_generate_line_rejects_unsafe_names(make_client, stub_exe, db, tmp_path, username, time_key):
+    form = {"username": username, "time_key": time_key, "voice": "Japanese Male 1", "line": "本日は晴天なり", "index": 0}
+    async with make_client(api_generate_line.router) as client:
+        response = await client.post("/api/generate-line", data=form)
+        assert response.status_code == 400
+        for path in ("/api/merge-audio", "/api/download-zip"):
+            response = await client.post(path, data={"username": username, "time_key": time_key})
+            assert response.status_code == 400
+    assert not (tmp_path / "precious").exists()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".wav") or name.endswith(".txt")]
@@ -0,0 +1,92 @@
+import os
+
+import pytest
+
+import api_history
+import config
+import history
+import storage
+from conftest import login
+
+
+def write_line(username, time_key, index, size):
+    path = os.path.join(storage.session_dir(username, time_key), f"{index:02d}.wav")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\x00" * size)
+    storage.track_files(username, time_key, path)
+    history.record_line(username, time_key, "Japanese Male 1", index)
+
+
+def test_session_lifecycle(db):
+    write_line("alice", "s1", 0, 100)
+    write_line("alice", "s1", 2, 50)
+    write_line("alice", "s1", 1, 50)
+    session = history.get_session("alice", "s1")
+    assert session["line_count"] == 3 and session["byte_size"] == 200
+    assert session["status"] == history.STATUS_RENDERING
+
+    history.finish_session("alice", "s1", history.STATUS_COMPLETED, line_count=3, total_duration=1.5)
+    session = history.get_session("alice", "s1")
+    assert session["status"] == history.STATUS_COMPLETED and session["total_duration"] == 1.5
+    assert session["voice"] == "Japanese Male 1"
+
+    storage.evict_session("alice", "s1")
+    session = history.get_session("alice", "s1")
+    assert session["status"] == history.STATUS_EVICTED and session["byte_size"] == 0
+
+
+def test_list_sessions_pagination(db):
+    for idx in range(7):
+        history.record_line("alice", f"s{idx}", "Japanese Male 1", 0)
+    history.record_line("bob", "s0", "Japanese Male 1", 0)
+
+    seen = list()
+    cursor = None
+    while True:
+        rows, cursor = history.list_sessions("alice", limit=3, before=cursor)
+        seen += [row["time_key"] for row in rows]
+        if cursor is None:
+            break
+    assert seen == [f"s{idx}" for idx in reversed(range(7))]
+    assert len(history.list_sessions(limit=100)[0]) == 8
+
+    with pytest.raises(ValueError):
+        history.list_sessions("alice", before="hogehoge")
+
+
+def test_import_existing_sessions(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STATIC_DIR", str(tmp_path / "static"))
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "users.db"))
+    session_path = os.path.join(config.STATIC_DIR, "alice", "s1")
+    os.makedirs(session_path)
+    for name in ("00.wav", "01.wav", "00.txt", "full.wav"):
+        with open(os.path.join(session_path, name), "wb") as f:
+            f.write(b"\x00" * 10)
+    storage.init_storage_db()
+    history.init_history_db()
+    session = history.get_session("alice", "s1")
+    assert session["line_count"] == 2 and session["byte_size"] == 40
+    assert session["status"] == history.STATUS_COMPLETED
+
+
+@pytest.mark.asyncio
+async def test_sessions_endpoint_permissions(make_client):
+    history.record_line("alice", "s1", "Japanese Male 1", 0)
+    history.record_line("bob", "s1", "Japanese Male 1", 0)
+    async with make_client(api_history.router) as client:
+        assert (await client.get("/api/sessions")).status_code == 401
+
+        await login(client, "alice")
+        response = await client.get("/api/sessions")
+        assert [row["username"] for row in response.json()["sessions"]] == ["alice"]
+        assert (await client.get("/api/sessions", params={"username": "bob"})).status_code == 403
+        assert (await client.get("/api/sessions", params={"username": "*"})).status_code == 403
+        assert (await client.get("/api/sessions/s1", params={"username": "bob"})).status_code == 403
+
+        await login(client, "admin", is_admin=True)
+        response = await client.get("/api/sessions", params={"username": "*"})
+        assert sorted(row["username"] for row in response.json()["sessions"]) == ["alice", "bob"]
+        response = await client.get("/api/sessions", params={"username": "bob"})
+        assert [row["username"] for row in response.json()["sessions"]] == ["bob"]
+        assert (await client.get("/api/sessions/s1", params={"username": "bob"})).status_code == 200
@@ -0,0 +1,59 @@
+import codecs
+
+import pytest
+
+import ingest
+
+
+async def collect(data, chunk_size=7, **kwargs):
+    async def chunks():
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+    return [line async for line in ingest.iter_lines(chunks(), **kwargs)]
+
+
+def test_detect_encoding():
+    text = "本日は晴天なり\n"
+    assert ingest.detect_encoding(text.encode("utf-8")) == "utf-8"
+    # Ký tự nhiều byte bị cắt ở cuối vẫn được coi là UTF-8
+    assert ingest.detect_encoding(text.encode("utf-8")[:-2]) == "utf-8"
+    assert ingest.detect_encoding(codecs.BOM_UTF8 + text.encode("utf-8")) == "utf-8-sig"
+    assert ingest.detect_encoding(text.encode("utf-16")) == "utf-16"
+    assert ingest.detect_encoding(text.encode("cp932")) == "cp932"
+
+
+def test_split_sentences():
+    assert ingest.split_sentences("短い文。") == ["短い文。"]
+    assert ingest.split_sentences("一。二。三。", max_chars=4) == ["一。二。", "三。"]
+    assert ingest.split_sentences("あ" * 10, max_chars=4) == ["ああああ", "ああああ", "ああ"]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("encoding", ["utf-8", "utf-8-sig", "utf-16", "cp932"])
+async def test_iter_lines(encoding):
+    text = "本日は晴天なり\r\n\r\n  二行目  \n最後の行"
+    assert await collect(text.encode(encoding)) == ["本日は晴天なり", "二行目", "最後の行"]
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_long_line():
+    text = "これは文です。" * 100
+    lines = await collect(text.encode("utf-8"), chunk_size=64)
+    assert "".join(lines) == text
+    assert all(len(line) <= ingest.MAX_LINE_CHARS for line in lines)
+
+
+@pytest.mark.asyncio
+async def test_iter_lines_is_lazy():
+    consumed = list()
+
+    async def chunks():
+        for idx in range(1000):
+            consumed.append(idx)
+            yield f"{'行' * 2000}{idx}\n".encode("utf-8")
+
+    lines = ingest.iter_lines(chunks())
+    await lines.__anext__()
+    await lines.aclose()
+    assert len(consumed) < 10
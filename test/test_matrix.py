@@ -0,0 +1,166 @@
+import asyncio
+import os
+import wave
+
+import pytest
+
+import api_matrix
+import config
+import stub_voicepeak
+import synthesis
+from conftest import login
+
+
+@pytest.fixture
+def client(stub_client):
+    return stub_client
+
+
+@pytest.fixture(autouse=True)
+def matrix_slots(monkeypatch):
+    # Semaphore dùng chung gắn với event loop của từng test
+    monkeypatch.setattr(api_matrix, "_slots", None)
+
+
+@pytest.mark.asyncio
+async def test_render_matrix(client, tmp_path):
+    import voicepeak_wrapper
+
+    output_dir = str(tmp_path / "matrix")
+    audition_path = str(tmp_path / "audition.wav")
+    cells = await client.render_matrix(
+        "本日は晴天なり",
+        output_dir,
+        narrators=[voicepeak_wrapper.Narrator("Japanese Male 1", ("happy",)), "Japanese Female 1", "hogehoge"],
+        emotions=[None, {"happy": 100}],
+        speeds=[50, 200],
+        concurrency=3,
+        audition_path=audition_path,
+    )
+
+    assert [cell.index for cell in cells] == list(range(12))
+    assert (cells[0].narrator, cells[0].emotions, cells[0].speed) == ("Japanese Male 1", None, 50)
+    assert (cells[7].narrator, cells[7].emotions, cells[7].speed) == ("Japanese Female 1", {"happy": 100}, 200)
+
+    rendered = [cell for cell in cells if cell.error is None]
+    assert len(rendered) == 8
+    assert all(cell.narrator == "hogehoge" for cell in cells if cell.error is not None)
+    assert all(os.path.exists(cell.output_path) for cell in rendered)
+
+    duration_ms = len("本日は晴天なり") * stub_voicepeak.MS_PER_CHAR
+    assert rendered[1].audition_start_ms == duration_ms + 500
+    with wave.open(audition_path, "rb") as wav:
+        assert wav.getnframes() == (duration_ms * 8 + 500 * 7) * stub_voicepeak.SAMPLE_RATE // 1000
+
+
+@pytest.mark.asyncio
+async def test_render_matrix_invalid(client, tmp_path):
+    with pytest.raises(ValueError):
+        await client.render_matrix("エラー", str(tmp_path), narrators=["Japanese Male 1"], speeds=[100, 201])
+    assert not os.path.exists(os.path.join(str(tmp_path), "000.wav"))
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"narrators": ["Japanese Male 1"], "emotions": [{"happy;touch pwned;x": 1}]},
+        {"narrators": ["Japanese Male 1"], "emotions": [["happy"]]},
+        {"narrators": ["Japanese Male 1"], "emotions": [{"happy": "100"}]},
+        {"narrators": ["Japanese Male 1", 5]},
+    ],
+)
+async def test_render_matrix_rejects_invalid_parameters(client, tmp_path, kwargs):
+    with pytest.raises(ValueError):
+        await client.render_matrix("エラー", str(tmp_path / "matrix"), **kwargs)
+    assert not os.path.exists(str(tmp_path / "matrix"))
+
+
+@pytest.mark.asyncio
+async def test_say_text_does_not_use_shell(client, tmp_path):
+    marker = tmp_path / "pwned"
+    output_path = str(tmp_path / "out.wav")
+    await client.say_text(f'"; touch "{marker}"; echo "', output_path=output_path, narrator="Japanese Male 1")
+    assert os.path.exists(output_path) and not marker.exists()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {"emotions": '[{"happy;touch /tmp/pwned_marker;x": 1}]'},
+        {"emotions": '[["happy"]]'},
+        {"emotions": '[{"happy": "100"}]'},
+        {"narrators": '["Japanese Male 1", 5]'},
+        {"narrators": '[""]'},
+        {"speeds": '["fast"]'},
+        {"pitches": "hogehoge"},
+    ],
+)
+async def test_render_matrix_endpoint_rejects_invalid_form(make_client, stub_exe, db, fields):
+    form = {"username": "alice", "time_key": "s1", "text": "本日は晴天なり", "narrators": '["Japanese Male 1"]'}
+    async with make_client(api_matrix.router) as client:
+        await login(client, "alice")
+        response = await client.post("/api/render-matrix", data={**form, **fields})
+    assert response.status_code == 400
+    assert not os.path.exists(os.path.join(db, "alice", "s1"))
+
+
+@pytest.mark.asyncio
+async def test_render_matrix_endpoint(make_client, stub_exe, db):
+    form = {
+        "username": "alice",
+        "time_key": "s1",
+        "text": "本日は晴天なり",
+        "narrators": '["Japanese Male 1", "Japanese Female 1"]',
+        "emotions": '[{"happy": 100}, null]',
+    }
+    async with make_client(api_matrix.router) as client:
+        assert (await client.post("/api/render-matrix", data=form)).status_code == 401
+        await login(client, "bob")
+        assert (await client.post("/api/render-matrix", data=form)).status_code == 403
+
+        await login(client, "alice")
+        response = await client.post("/api/render-matrix", data=form)
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total_cells"] == 4 and body["failed_cells"] == 0
+    assert os.path.isfile(os.path.join(db, "alice", "s1", "audition.wav"))
+
+
+@pytest.mark.asyncio
+async def test_render_matrix_endpoint_shares_engine_pool(make_client, stub_exe, db, monkeypatch):
+    monkeypatch.setattr(config, "MATRIX_CONCURRENCY", 2)
+    monkeypatch.setenv("STUB_VOICEPEAK_DELAY", "0.05")
+    create_subprocess_exec = asyncio.create_subprocess_exec
+    running = list()
+    peak = list()
+
+    async def counting_exec(*args, **kwargs):
+        proc = await create_subprocess_exec(*args, **kwargs)
+        communicate = proc.communicate
+        running.append(proc)
+        peak.append((len(running), synthesis._idle.is_set()))
+
+        async def tracked_communicate(*args, **kwargs):
+            try:
+                return await communicate(*args, **kwargs)
+            finally:
+                running.remove(proc)
+
+        proc.communicate = tracked_communicate
+        return proc
+
+    monkeypatch.setattr(asyncio, "create_subprocess_exec", counting_exec)
+    form = {"username": "alice", "text": "本日は晴天なり", "narrators": '["Japanese Male 1", "Japanese Female 1"]'}
+    async with make_client(api_matrix.router) as client:
+        await login(client, "alice")
+        responses = await asyncio.gather(
+            *(client.post("/api/render-matrix", data={**form, "time_key": f"s{idx}"}) for idx in range(3))
+        )
+    assert all(response.status_code == 200 for response in responses)
+    # 3 request cùng lúc vẫn chỉ chạy tối đa MATRIX_CONCURRENCY tiến trình, và dòng nháp phải nhường
+    assert len(peak) == 6
+    assert max(count for count, idle in peak) <= config.MATRIX_CONCURRENCY
+    assert not any(idle for count, idle in peak)
+    assert synthesis._idle.is_set()
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+import pytest
+from fastapi.responses import JSONResponse
+
+import config
+import profiling
+import storage
+
+
+ADMIN_SESSION = {"username": "admin", "is_admin": True}
+
+
+class FakeRequest:
+    def __init__(self, headers, session=None):
+        self.headers = headers
+        self.scope = {"session": session} if session is not None else dict()
+
+
+@pytest.fixture
+def static_dir(db, monkeypatch):
+    monkeypatch.setattr(config, "PROFILE_INTERVAL_MS", 1)
+    monkeypatch.setattr(profiling, "recent", profiling.deque(maxlen=10))
+    os.makedirs(storage.session_dir("alice", "s1"))
+    return db
+
+
+@profiling.profiled("/api/test")
+async def handler(request, username, time_key):
+    with profiling.span("outer"):
+        await asyncio.to_thread(profiling.traced("inner", time.sleep), 0.05)
+    return JSONResponse({"ok": True})
+
+
+@pytest.mark.asyncio
+async def test_profiled_request(static_dir):
+    response = await handler(request=FakeRequest({"X-Profile": "1"}, ADMIN_SESSION), username="alice", time_key="s1")
+    profile_id = response.headers["X-Profile-Id"]
+    assert profiling.list_saved("alice", "s1") == [profile_id]
+    assert profiling.recent[0]["id"] == profile_id
+
+    with open(profiling.profile_path("alice", "s1", profile_id), encoding="utf-8") as f:
+        profile = json.load(f)
+    spans = {span["name"]: span for span in profile["spans"]}
+    assert set(spans) == {"/api/test", "outer", "inner"}
+    # inner chạy trong thread pool, nằm trong outer
+    assert spans["inner"]["thread"] != spans["outer"]["thread"]
+    assert spans["outer"]["start_ms"] <= spans["inner"]["start_ms"] <= spans["inner"]["end_ms"]
+    assert spans["inner"]["end_ms"] <= spans["outer"]["end_ms"]
+    # Mẫu lấy được cả stack của thread pool đang chạy hàm được bọc
+    assert profile["sample_count"] > 0
+    assert any("wrapper (profiling.py" in stack for stack in profile["samples"])
+    assert storage.get_user_usage("alice") == os.path.getsize(profiling.profile_path("alice", "s1", profile_id))
+
+
+@pytest.mark.asyncio
+async def test_not_profiled_by_default(static_dir):
+    response = await handler(request=FakeRequest({}), username="alice", time_key="s1")
+    assert "X-Profile-Id" not in response.headers
+    assert profiling.list_saved("alice", "s1") == []
+    with profiling.span("noop"):
+        pass
+
+
+def test_header_requires_admin_or_token(monkeypatch):
+    header = {"X-Profile": "1"}
+    assert not profiling.is_requested(FakeRequest(header))
+    assert not profiling.is_requested(FakeRequest(header, {"username": "alice", "is_admin": False}))
+    assert profiling.is_requested(FakeRequest(header, ADMIN_SESSION))
+    assert not profiling.is_requested(FakeRequest({"X-Profile": "0"}, ADMIN_SESSION))
+
+    monkeypatch.setattr(config, "PROFILE_TOKEN", "s3cret")
+    assert profiling.is_requested(FakeRequest({"X-Profile": "s3cret"}))
+    assert not profiling.is_requested(FakeRequest({"X-Profile": "1"}))
+
+
+def sleep_a(seconds):
+    time.sleep(seconds)
+
+
+def sleep_b(seconds):
+    time.sleep(seconds)
+
+
+@profiling.profiled("/api/test-a")
+async def handler_a(request, username, time_key):
+    await asyncio.to_thread(profiling.traced("a", sleep_a), 0.1)
+    return JSONResponse({"ok": True})
+
+
+@profiling.profiled("/api/test-b")
+async def handler_b(request, username, time_key):
+    await asyncio.to_thread(profiling.traced("b", sleep_b), 0.1)
+    return JSONResponse({"ok": True})
+
+
+@pytest.mark.asyncio
+async def test_concurrent_profiles_share_sampler(static_dir):
+    request = FakeRequest({"X-Profile": "1"}, ADMIN_SESSION)
+    sampler_counts = list()
+
+    async def watch():
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+            sampler_counts.append(
+                sum(1 for thread in threading.enumerate() if thread.name.startswith(profiling.SAMPLER_THREAD_PREFIX))
+            )
+
+    response_a, response_b, _ = await asyncio.gather(
+        handler_a(request=request, username="alice", time_key="s1"),
+        handler_b(request=request, username="alice", time_key="s1"),
+        watch(),
+    )
+    assert set(sampler_counts) == {1}
+    assert not profiling.sampler.is_running()
+
+    def stacks(response):
+        path = profiling.profile_path("alice", "s1", response.headers["X-Profile-Id"])
+        with open(path, encoding="utf-8") as f:
+            return list(json.load(f)["samples"])
+
+    # Stack của thread pool chỉ được tính cho profile đã gửi việc đó vào thread
+    assert any("sleep_a (" in stack for stack in stacks(response_a))
+    assert not any("sleep_b (" in stack for stack in stacks(response_a))
+    assert any("sleep_b (" in stack for stack in stacks(response_b))
+    assert not any("sleep_a (" in stack for stack in stacks(response_b))
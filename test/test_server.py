@@ -0,0 +1,32 @@
+import os
+
+import httpx
+import pytest
+
+import storage
+
+
+@pytest.mark.asyncio
+async def test_generate_keeps_uploaded_file_separate(db, stub_exe, monkeypatch):
+    import server
+
+    monkeypatch.setattr(server, "STATIC_DIR", db)
+    monkeypatch.setattr(server, "DB_PATH", os.path.join(os.path.dirname(db), "users.db"))
+    server.init_db()
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        await client.post("/login", data={"username": "admin", "password": "admin123"})
+        # File upload trùng tên với file kết quả voice_lines.txt
+        script = "一行目\n二行目\n".encode()
+        response = await client.post(
+            "/generate",
+            data={"voice": "Japanese Male 1"},
+            files={"text_file": ("voice_lines.txt", script, "text/plain")},
+        )
+    assert response.status_code == 200
+    (time_key,) = os.listdir(os.path.join(db, "admin"))
+    session_path = storage.session_dir("admin", time_key)
+    with open(os.path.join(session_path, "source_voice_lines.txt"), "rb") as f:
+        assert f.read() == script
+    with open(os.path.join(session_path, "voice_lines.txt"), encoding="utf-8") as f:
+        assert f.read() == "0: 一行目\n1: 二行目\n"
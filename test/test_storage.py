@@ -0,0 +1,153 @@
+import os
+import time
+
+import pytest
+
+import config
+import db as db_module
+import history
+import storage
+
+
+def write_file(username, time_key, name, size):
+    path = os.path.join(storage.session_dir(username, time_key), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\x00" * size)
+    storage.track_files(username, time_key, path)
+    return path
+
+
+def test_track_files(db):
+    write_file("alice", "s1", "00.wav", 100)
+    write_file("alice", "s1", "00.txt", 10)
+    write_file("alice", "s2", "00.wav", 50)
+    assert storage.get_user_usage("alice") == 160
+
+    # Tạo lại một dòng: chỉ cộng phần chênh lệch
+    write_file("alice", "s1", "00.wav", 40)
+    assert storage.get_user_usage("alice") == 100
+    assert storage.list_user_usage() == {"alice": (100, 2)}
+
+    path = os.path.join(storage.session_dir("alice", "s2"), "00.wav")
+    os.remove(path)
+    storage.track_files("alice", "s2", path)
+    assert storage.get_user_usage("alice") == 50
+
+
+def test_rebuild_index(db):
+    write_file("alice", "s1", "00.wav", 100)
+    write_file("bob", "s1", "sub/00.wav", 30)
+    storage.rebuild_index()
+    assert storage.list_user_usage() == {"alice": (100, 1), "bob": (30, 1)}
+
+
+def test_enforce_quota(db, monkeypatch):
+    monkeypatch.setattr(config, "STORAGE_QUOTA_BYTES", 250)
+    monkeypatch.setattr(config, "SWEEP_ACTIVE_SECONDS", 0)
+    for time_key in ("old", "mid", "new"):
+        write_file("alice", time_key, "00.wav", 100)
+        time.sleep(0.01)
+    storage.touch_session("alice", "old")
+
+    assert storage.enforce_quota("alice", keep_time_key="new")
+    assert not os.path.exists(storage.session_dir("alice", "mid"))
+    assert os.path.exists(storage.session_dir("alice", "old"))
+    assert storage.get_user_usage("alice") == 200
+
+    monkeypatch.setattr(config, "STORAGE_QUOTA_BYTES", 50)
+    assert not storage.enforce_quota("alice", keep_time_key="new")
+    assert os.path.exists(storage.session_dir("alice", "new"))
+
+
+def test_sweep(db, monkeypatch):
+    monkeypatch.setattr(config, "SESSION_RETENTION_SECONDS", 60)
+    monkeypatch.setattr(config, "ZIP_RETENTION_SECONDS", 60)
+    write_file("alice", "s1", "00.wav", 100)
+    os.makedirs(config.ZIP_DIR)
+    zip_path = os.path.join(config.ZIP_DIR, "alice_s1.zip")
+    open(zip_path, "wb").close()
+
+    assert storage.sweep() == {"evicted_sessions": 0, "removed_archives": 0}
+    assert storage.sweep(now=time.time() + 120) == {"evicted_sessions": 1, "removed_archives": 1}
+    assert not os.path.exists(storage.session_dir("alice", "s1"))
+    assert not os.path.exists(zip_path)
+    assert storage.get_user_usage("alice") == 0
+
+
+def set_last_access(username, time_key, last_access):
+    conn = db_module.connect()
+    conn.execute(
+        "UPDATE storage_sessions SET last_access=? WHERE username=? AND time_key=?", (last_access, username, time_key)
+    )
+    conn.close()
+
+
+def test_sweep_keeps_active_sessions(db, monkeypatch):
+    monkeypatch.setattr(config, "STORAGE_QUOTA_BYTES", 150)
+    for time_key in ("old", "rendering", "recent"):
+        write_file("alice", time_key, "00.wav", 100)
+    history.finish_session("alice", "old", history.STATUS_COMPLETED)
+    history.record_line("alice", "rendering", "Japanese Male 1", 0)
+    set_last_access("alice", "old", time.time() - 3600)
+    set_last_access("alice", "rendering", time.time() - 3600)
+
+    storage.sweep()
+    assert not os.path.exists(storage.session_dir("alice", "old"))
+    assert os.path.exists(storage.session_dir("alice", "rendering"))
+    assert os.path.exists(storage.session_dir("alice", "recent"))
+
+
+def test_request_quota_keeps_active_sessions(db, monkeypatch):
+    # Đường request (enforce_quota không truyền active_since) cũng không xóa session đang tạo/đang nghe
+    monkeypatch.setattr(config, "STORAGE_QUOTA_BYTES", 50)
+    for time_key in ("old", "other_tab"):
+        write_file("alice", time_key, "00.wav", 100)
+    history.finish_session("alice", "old", history.STATUS_COMPLETED)
+    set_last_access("alice", "old", time.time() - 3600)
+
+    # Vẫn vượt quota: từ chối (507) thay vì xóa session đang dùng
+    assert not storage.enforce_quota("alice", "new")
+    assert not os.path.exists(storage.session_dir("alice", "old"))
+    assert os.path.exists(storage.session_dir("alice", "other_tab"))
+
+
+def test_access_due_is_rate_limited(db):
+    write_file("alice", "s1", "00.wav", 100)
+    assert storage.access_due("alice", "s1")
+    assert not storage.access_due("alice", "s1")
+    assert storage.access_due("alice", "s1", now=time.time() + config.ACCESS_TOUCH_INTERVAL_SECONDS)
+
+
+def test_works_without_history_table(tmp_path, monkeypatch):
+    # Bảng sessions thuộc history: storage vẫn chạy được khi history chưa khởi tạo
+    monkeypatch.setattr(config, "STATIC_DIR", str(tmp_path / "static"))
+    monkeypatch.setattr(config, "DB_PATH", str(tmp_path / "users.db"))
+    storage.init_storage_db()
+    write_file("alice", "s1", "00.wav", 100)
+    assert storage.get_user_usage("alice") == 100
+    storage.evict_session("alice", "s1")
+    assert storage.get_user_usage("alice") == 0
+
+
+def test_refuses_paths_outside_static(db, tmp_path, monkeypatch):
+    precious = tmp_path / "precious"
+    precious.mkdir()
+    (precious / "keep.txt").write_text("x")
+    with pytest.raises(ValueError):
+        storage.track_files("mallory", "../../precious", str(precious / "keep.txt"))
+    with pytest.raises(ValueError):
+        storage.track_files("mallory", ".", os.path.join(storage.session_dir("mallory", "."), "00.wav"))
+
+    # Bản ghi xấu đã có sẵn trong DB: bộ dọn dẹp bỏ bản ghi nhưng không xóa thư mục ngoài static/
+    monkeypatch.setattr(config, "SESSION_RETENTION_SECONDS", 60)
+    conn = db_module.connect()
+    for time_key in ("../../precious", ".."):
+        conn.execute(
+            "INSERT INTO storage_sessions (username, time_key, bytes, last_access) VALUES (?, ?, 1, 0)",
+            ("mallory", time_key),
+        )
+    conn.close()
+    assert storage.sweep()["evicted_sessions"] == 2
+    assert (precious / "keep.txt").exists() and os.path.isdir(db)
+    assert storage.list_user_usage() == {}
@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+import pytest
+
+import config
+import synthesis
+
+
+@pytest.fixture
+def client(stub_client, tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SYNTH_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(synthesis, "drafts", synthesis.DraftRenderer())
+    return stub_client
+
+
+@pytest.mark.asyncio
+async def test_render_uses_cache(client, tmp_path):
+    first = str(tmp_path / "first.wav")
+    second = str(tmp_path / "second.wav")
+    key = await synthesis.render(client, "本日は晴天なり", "Japanese Male 1", first)
+    cached = synthesis.cache_path(key)
+    assert os.path.exists(first) and os.path.exists(cached)
+
+    mtime = os.path.getmtime(cached)
+    await synthesis.render(client, "本日は晴天なり", "Japanese Male 1", second)
+    assert open(first, "rb").read() == open(second, "rb").read()
+    assert os.path.getmtime(cached) >= mtime
+
+    with pytest.raises(RuntimeError):
+        await synthesis.render(client, "本日は晴天なり", "hogehoge", str(tmp_path / "error.wav"))
+    assert not os.path.exists(synthesis.cache_path(synthesis.cache_key("hogehoge", "本日は晴天なり")))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_render_shares_work(client, tmp_path, monkeypatch):
+    monkeypatch.setenv("STUB_VOICEPEAK_DELAY", "0.3")
+    paths = [str(tmp_path / f"{idx}.wav") for idx in range(3)]
+    await asyncio.gather(*(synthesis.render(client, "同じ行", "Japanese Male 1", path) for path in paths))
+    assert all(os.path.exists(path) for path in paths)
+    assert synthesis._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_draft_renderer(client, monkeypatch):
+    monkeypatch.setenv("STUB_VOICEPEAK_DELAY", "0.2")
+    monkeypatch.setattr(config, "SPECULATIVE_WORKERS", 1)
+    drafts = synthesis.drafts
+    voice = "Japanese Male 1"
+
+    result = drafts.update(client, "alice", voice, ["一行目", "二行目", "三行目"])
+    assert result == {"queued": 3, "cancelled": 0, "cached": 0, "skipped": 0, "pending": 3}
+
+    # Sửa dòng 3 trước khi nó kịp được tạo
+    await asyncio.sleep(0.05)
+    result = drafts.update(client, "alice", voice, ["一行目", "二行目", "三行目を修正"])
+    assert result["queued"] == 1 and result["cancelled"] == 1
+
+    while drafts.pending():
+        await asyncio.sleep(0.05)
+    # User không còn dòng chờ thì không còn giữ entry trong _jobs
+    assert drafts._jobs == {}
+    for line in ("一行目", "二行目", "三行目を修正"):
+        assert os.path.exists(synthesis.cache_path(synthesis.cache_key(voice, line)))
+    assert not os.path.exists(synthesis.cache_path(synthesis.cache_key(voice, "三行目")))
+
+    result = drafts.update(client, "alice", voice, ["一行目", "二行目"])
+    assert result == {"queued": 0, "cancelled": 0, "cached": 2, "skipped": 0, "pending": 0}
+    assert drafts._jobs == {}
+
+
+@pytest.mark.asyncio
+async def test_draft_renderer_caps_pending(client, monkeypatch):
+    monkeypatch.setenv("STUB_VOICEPEAK_DELAY", "0.2")
+    monkeypatch.setattr(config, "SPECULATIVE_MAX_PENDING", 3)
+    drafts = synthesis.drafts
+    voice = "Japanese Male 1"
+
+    assert drafts.update(client, "alice", voice, ["一行目", "二行目"])["queued"] == 2
+    result = drafts.update(client, "bob", voice, ["三行目", "四行目"])
+    assert result["queued"] == 1 and result["skipped"] == 1
+    assert drafts.pending() == 3
+
+    # Xóa hết bản nháp -> hủy các dòng chờ và bỏ entry của user
+    drafts.update(client, "alice", voice, [])
+    drafts.update(client, "bob", voice, [])
+    assert drafts._jobs == {}
+
+
+def test_trim_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "SYNTH_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "SYNTH_CACHE_MAX_BYTES", 25)
+    for idx in range(5):
+        path = synthesis.cache_path(f"{idx:02d}{'0' * 62}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(b"\x00" * 10)
+        os.utime(path, (idx, idx))
+    assert synthesis.trim_cache() == 3
+    assert os.path.exists(synthesis.cache_path(f"04{'0' * 62}"))
+
+
+@pytest.mark.asyncio
+async def test_draft_edits_do_not_stack_engine_runs(client, monkeypatch):
+    monkeypatch.setenv("STUB_VOICEPEAK_DELAY", "0.3")
+    monkeypatch.setattr(config, "SPECULATIVE_WORKERS", 1)
+    drafts = synthesis.drafts
+    voice = "Japanese Male 1"
+
+    # Sửa cùng một dòng liên tục: mỗi lần hủy dòng cũ, nhưng tiến trình của dòng cũ vẫn giữ slot
+    inflight = list()
+    for idx in range(6):
+        drafts.update(client, "alice", voice, [f"一行目{'!' * idx}"])
+        await asyncio.sleep(0.15)
+        inflight.append(len(synthesis._inflight))
+    assert max(inflight) <= config.SPECULATIVE_WORKERS
+
+    drafts.update(client, "alice", voice, [])
+    while synthesis._inflight:
+        await asyncio.sleep(0.05)
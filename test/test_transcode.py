@@ -0,0 +1,117 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+import storage
+import transcode
+
+FIREFOX_ACCEPT = "audio/webm,audio/ogg,audio/wav,audio/*;q=0.9,application/ogg;q=0.7,video/*;q=0.6,*/*;q=0.5"
+
+
+@pytest.fixture
+def encoders(monkeypatch):
+    """
+    Thay encoder thật bằng lệnh copy file để test không phụ thuộc ffmpeg/flac.
+    """
+    calls = list()
+
+    def fake_command(fmt, src, dst):
+        calls.append(fmt)
+        return [sys.executable, "-c", "import shutil, sys; shutil.copy(sys.argv[1], sys.argv[2])", src, dst]
+
+    monkeypatch.setattr(transcode, "encoder_command", fake_command)
+    monkeypatch.setattr(transcode, "_broken", set())
+    return calls
+
+
+def test_negotiate_without_encoder(monkeypatch):
+    monkeypatch.setattr(transcode, "encoder_command", lambda fmt, src, dst: None)
+    assert transcode.negotiate(FIREFOX_ACCEPT) == "wav"
+    assert transcode.negotiate("audio/flac") == "wav"
+    assert transcode.negotiate(None, "flac") == "wav"
+
+
+def test_negotiate(encoders):
+    assert transcode.negotiate(FIREFOX_ACCEPT) == "opus"
+    assert transcode.negotiate("*/*") == "mp3"
+    assert transcode.negotiate(None) == "mp3"
+    assert transcode.negotiate("audio/flac, audio/mpeg;q=0.5") == "flac"
+    assert transcode.negotiate("audio/*, audio/mpeg;q=0") == "flac"
+    assert transcode.negotiate("text/html") == "wav"
+    assert transcode.negotiate("*/*", "flac") == "flac"
+
+
+def test_get_variant(encoders, db):
+    wav_path = os.path.join(storage.session_dir("alice", "s1"), "00.wav")
+    os.makedirs(os.path.dirname(wav_path))
+    with open(wav_path, "wb") as f:
+        f.write(b"RIFF")
+
+    path = asyncio.run(transcode.get_variant("alice", "s1", wav_path, "flac"))
+    assert path.endswith("00.flac") and os.path.exists(path)
+    assert storage.get_user_usage("alice") == 4
+
+    # Bản nén còn mới -> dùng lại, không encode lần nữa
+    asyncio.run(transcode.get_variant("alice", "s1", wav_path, "flac"))
+    assert encoders.count("flac") == 1
+
+    # Tạo lại dòng -> bản nén cũ bị encode lại
+    os.utime(wav_path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    asyncio.run(transcode.get_variant("alice", "s1", wav_path, "flac"))
+    assert encoders.count("flac") == 2
+
+
+def write_wav(name):
+    wav_path = os.path.join(storage.session_dir("alice", "s1"), name)
+    os.makedirs(os.path.dirname(wav_path), exist_ok=True)
+    with open(wav_path, "wb") as f:
+        f.write(b"RIFF")
+    return wav_path
+
+
+@pytest.fixture
+def failing_encoder(monkeypatch):
+    """
+    Encoder lỗi với file có "bad" trong tên; thông báo lỗi lấy từ message["text"].
+    """
+    message = {"text": "Invalid data found when processing input"}
+    script = (
+        "import shutil, sys\n"
+        "if 'bad' in sys.argv[1]:\n"
+        "    sys.stderr.write(sys.argv[3])\n"
+        "    sys.exit(1)\n"
+        "shutil.copy(sys.argv[1], sys.argv[2])\n"
+    )
+    monkeypatch.setattr(
+        transcode, "encoder_command", lambda fmt, src, dst: [sys.executable, "-c", script, src, dst, message["text"]]
+    )
+    monkeypatch.setattr(transcode, "_broken", set())
+    monkeypatch.setattr(transcode, "_failed", dict())
+    return message
+
+
+def test_get_variant_file_failure_falls_back_for_that_file(failing_encoder, db):
+    bad_path = write_wav("bad.wav")
+    assert asyncio.run(transcode.get_variant("alice", "s1", bad_path, "mp3")) == bad_path
+    assert "mp3" in transcode.available_formats() and transcode._locks == {}
+    assert not [name for name in os.listdir(os.path.dirname(bad_path)) if name.endswith(".tmp")]
+
+    good_path = write_wav("00.wav")
+    assert asyncio.run(transcode.get_variant("alice", "s1", good_path, "mp3")).endswith("00.mp3")
+    assert transcode._locks == {}
+
+
+def test_get_variant_missing_codec_disables_format(failing_encoder, db):
+    failing_encoder["text"] = "Unknown encoder 'libmp3lame'"
+    bad_path = write_wav("bad.wav")
+    assert asyncio.run(transcode.get_variant("alice", "s1", bad_path, "mp3")) == bad_path
+    assert "mp3" not in transcode.available_formats()
+
+
+def test_probe_encoders(failing_encoder, monkeypatch):
+    assert "flac" in asyncio.run(transcode.probe_encoders())
+
+    monkeypatch.setattr(transcode, "encoder_command", lambda fmt, src, dst: [sys.executable, "-c", "exit(1)"])
+    assert asyncio.run(transcode.probe_encoders()) == ("wav",)
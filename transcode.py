@@ -0,0 +1,247 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import wave
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import config
+import storage
+
+# Bản nén của file wav (từng dòng và full.wav) để nghe thử qua mạng chậm.
+# File wav gốc không bao giờ bị sửa; bản nén được lưu cạnh file gốc (00.wav -> 00.mp3, 00.flac, ...)
+# và được tạo lại khi file gốc mới hơn (ví dụ khi một dòng được tạo lại).
+
+FORMATS = {
+    "opus": ("audio/ogg", ".opus"),
+    "mp3": ("audio/mpeg", ".mp3"),
+    "flac": ("audio/flac", ".flac"),
+    "wav": ("audio/wav", ".wav"),
+}
+MIME_ALIASES = {
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/flac": "flac",
+    "audio/x-flac": "flac",
+    "audio/wav": "wav",
+    "audio/wave": "wav",
+    "audio/x-wav": "wav",
+}
+# Thứ tự ưu tiên khi trình duyệt chấp nhận mọi định dạng (*/*, audio/*).
+# Opus chỉ được chọn khi trình duyệt khai báo rõ audio/ogg vì Safari cũ không phát được.
+PREFERENCE = ("opus", "mp3", "flac", "wav")
+WILDCARD_FORMATS = ("mp3", "flac", "wav")
+VARIANT_EXTENSIONS = tuple(ext for fmt, (mime, ext) in FORMATS.items() if fmt != "wav")
+
+# Thông báo lỗi của ffmpeg khi bản build không có codec: khi đó cả định dạng bị bỏ (_broken),
+# còn lỗi khác chỉ làm riêng file đó quay về wav (_failed: bản nén -> mtime file gốc lúc encode lỗi)
+CODEC_MISSING_MARKERS = ("Unknown encoder", "Encoder not found", "Unknown output format")
+
+_locks: dict[str, tuple[asyncio.Lock, int]] = dict()
+_broken: set[str] = set()
+_failed: dict[str, float] = dict()
+_background: set[asyncio.Task] = set()
+
+
+@lru_cache(maxsize=None)
+def find_encoder(name):
+    return shutil.which(name)
+
+
+def encoder_command(fmt, src, dst):
+    """
+    Trả về lệnh encode src -> dst bằng encoder có sẵn trên máy, hoặc None nếu không có.
+    """
+    ffmpeg = find_encoder("ffmpeg")
+    ffmpeg_args = [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", src] if ffmpeg else None
+    match fmt:
+        case "flac":
+            if find_encoder("flac"):
+                return [find_encoder("flac"), "--silent", "--force", "-5", "-o", dst, src]
+            if ffmpeg:
+                return ffmpeg_args + ["-c:a", "flac", "-f", "flac", dst]
+        case "mp3":
+            if find_encoder("lame"):
+                return [find_encoder("lame"), "--quiet", "-b", str(config.TRANSCODE_MP3_KBPS), src, dst]
+            if ffmpeg:
+                return ffmpeg_args + ["-c:a", "libmp3lame", "-b:a", f"{config.TRANSCODE_MP3_KBPS}k", "-f", "mp3", dst]
+        case "opus":
+            if find_encoder("opusenc"):
+                return [find_encoder("opusenc"), "--quiet", "--bitrate", str(config.TRANSCODE_OPUS_KBPS), src, dst]
+            if ffmpeg:
+                return ffmpeg_args + ["-c:a", "libopus", "-b:a", f"{config.TRANSCODE_OPUS_KBPS}k", "-f", "ogg", dst]
+    return None
+
+
+def available_formats():
+    return tuple(
+        fmt for fmt in PREFERENCE if fmt == "wav" or (fmt not in _broken and encoder_command(fmt, "", "") is not None)
+    )
+
+
+async def encode(fmt, src, dst):
+    """
+    Encode src -> dst. Trả về (thành công, stderr); encoder không chạy được hoặc thiếu codec
+    thì đánh dấu cả định dạng là hỏng.
+    """
+    command = encoder_command(fmt, src, dst)
+    if command is None:
+        return False, ""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+    except OSError as e:
+        _broken.add(fmt)
+        return False, str(e)
+    _, stderr = await proc.communicate()
+    message = stderr.decode(errors="replace")
+    if proc.returncode == 0 and os.path.exists(dst):
+        return True, message
+    if any(marker in message for marker in CODEC_MISSING_MARKERS):
+        _broken.add(fmt)
+    return False, message
+
+
+async def probe_encoders():
+    """
+    Thử encode một đoạn im lặng ngắn bằng từng encoder lúc khởi động; định dạng nào lỗi thì không dùng nữa.
+    """
+    formats = [fmt for fmt in available_formats() if fmt != "wav"]
+    if not formats:
+        return available_formats()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        src = os.path.join(tmp_dir, "probe.wav")
+        with wave.open(src, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(48000)
+            f.writeframes(b"\x00\x00" * 4800)
+        for fmt in formats:
+            ok, message = await encode(fmt, src, variant_path(src, fmt))
+            if not ok:
+                _broken.add(fmt)
+                print(f"Không dùng được encoder {fmt}: {message}")
+    return available_formats()
+
+
+def parse_accept(accept):
+    """
+    Phân tích header Accept thành list (mime, q)
+    """
+    result = list()
+    for part in (accept or "*/*").split(","):
+        fields = [field.strip() for field in part.split(";")]
+        if not fields[0]:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        result.append((fields[0].lower(), q))
+    return result
+
+
+def negotiate(accept, requested=None):
+    """
+    Chọn định dạng trả về theo tham số ?format= (nếu có) hoặc theo header Accept.
+    """
+    available = available_formats()
+    if requested:
+        return requested if requested in available else "wav"
+    specific = dict()
+    wildcard = 0.0
+    for mime, q in parse_accept(accept):
+        if mime in ("*/*", "audio/*"):
+            wildcard = max(wildcard, q)
+        elif mime in MIME_ALIASES:
+            fmt = MIME_ALIASES[mime]
+            specific[fmt] = max(specific.get(fmt, 0.0), q)
+    # Khai báo cụ thể (kể cả q=0) được ưu tiên hơn wildcard
+    scores = {
+        fmt: specific[fmt] if fmt in specific else (wildcard if fmt in WILDCARD_FORMATS else 0.0) for fmt in available
+    }
+    candidates = [fmt for fmt in available if scores[fmt] > 0]
+    if not candidates:
+        return "wav"
+    return max(candidates, key=lambda fmt: (scores[fmt], -PREFERENCE.index(fmt)))
+
+
+def variant_path(wav_path, fmt):
+    return os.path.splitext(wav_path)[0] + FORMATS[fmt][1]
+
+
+def is_fresh(wav_path, path):
+    return os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(wav_path)
+
+
+@asynccontextmanager
+async def path_lock(path):
+    """
+    Khóa theo đường dẫn bản nén; entry trong _locks bị xóa khi không còn ai dùng.
+    """
+    lock, users = _locks.get(path, (None, 0))
+    lock = lock or asyncio.Lock()
+    _locks[path] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _locks[path]
+        if users == 1:
+            del _locks[path]
+        else:
+            _locks[path] = (lock, users - 1)
+
+
+async def get_variant(username, time_key, wav_path, fmt):
+    """
+    Trả về đường dẫn bản nén fmt của wav_path, tạo mới nếu chưa có hoặc đã cũ.
+    Nếu encode lỗi thì trả về chính wav_path (không encode lại file này cho tới khi file gốc đổi).
+    """
+    if fmt == "wav":
+        return wav_path
+    path = variant_path(wav_path, fmt)
+    if is_fresh(wav_path, path):
+        return path
+    async with path_lock(path):
+        if is_fresh(wav_path, path):
+            return path
+        source_mtime = os.path.getmtime(wav_path)
+        if _failed.get(path) == source_mtime:
+            return wav_path
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            ok, message = await encode(fmt, wav_path, tmp_path)
+            if not ok:
+                _failed[path] = source_mtime
+                print(f"Lỗi khi encode {fmt} cho {wav_path}: {message}")
+                return wav_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        _failed.pop(path, None)
+        # Gán mtime của file gốc lúc bắt đầu encode: nếu file gốc bị ghi lại trong lúc encode
+        # thì bản nén sẽ bị coi là cũ
+        os.utime(path, (source_mtime, source_mtime))
+    await asyncio.to_thread(storage.track_files, username, time_key, path)
+    return path
+
+
+def prewarm(username, time_key, wav_path):
+    """
+    Tạo trước bản nén ưu tiên trong nền để lần nghe đầu tiên không phải chờ encode.
+    """
+    for fmt in available_formats():
+        if fmt in WILDCARD_FORMATS and fmt != "wav":
+            task = asyncio.get_running_loop().create_task(get_variant(username, time_key, wav_path, fmt))
+            _background.add(task)
+            task.add_done_callback(_background.discard)
+            return
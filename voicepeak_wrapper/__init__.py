@@ -2,6 +2,6 @@
 # This software is released under the MIT License
 # https://opensource.org/license/mit/
 
-from .voicepeak import Narrator, Voicepeak
+from .voicepeak import MatrixCell, Narrator, Voicepeak
 
-__all__ = ["Narrator", "Voicepeak"]
+__all__ = ["MatrixCell", "Narrator", "Voicepeak"]
@@ -1,7 +1,48 @@
 import asyncio
+import wave
+
 
 def say_text_sync(client, line, wav_path, voice):
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(client.say_text(line, output_path=wav_path, narrator=voice))
     loop.close()
+
+
+def wav_duration_ms(wav_path):
+    """
+    Độ dài file wav (ms), chỉ đọc header.
+    """
+    with wave.open(wav_path, "rb") as wav:
+        return int(wav.getnframes() / wav.getframerate() * 1000)
+
+
+def concat_wav(wav_paths, output_path, pause_ms=500):
+    """
+    Nối các file wav thành một file (theo định dạng của file đầu tiên), chèn khoảng lặng pause_ms giữa các file.
+    Ghi lần lượt từng file nên bộ nhớ không phụ thuộc tổng độ dài.
+
+    Trả về:
+        list[tuple[int, int]]: Thời điểm bắt đầu, kết thúc (ms) của từng file trong file kết quả
+    """
+    with wave.open(wav_paths[0], "rb") as first_wav:
+        params = first_wav.getparams()
+    pause_frames = int(params.framerate * pause_ms / 1000)
+    pause_data = b"\x00" * (pause_frames * params.sampwidth * params.nchannels)
+
+    spans = list()
+    current_time_ms = 0
+    with wave.open(output_path, "wb") as output_wav:
+        output_wav.setparams(params)
+        for idx, wav_path in enumerate(wav_paths):
+            with wave.open(wav_path, "rb") as wav:
+                nframes = wav.getnframes()
+                output_wav.writeframesraw(wav.readframes(nframes))
+            duration_ms = int((nframes / params.framerate) * 1000)
+            spans.append((current_time_ms, current_time_ms + duration_ms))
+            current_time_ms += duration_ms
+            # Thêm khoảng nghỉ (trừ file cuối cùng)
+            if idx < len(wav_paths) - 1:
+                output_wav.writeframesraw(pause_data)
+                current_time_ms += pause_ms
+    return spans
@@ -4,7 +4,14 @@
 
 import asyncio
 from dataclasses import dataclass
+import itertools
 import os
+import re
+
+from .util import concat_wav
+
+# Tên cảm xúc hợp lệ (chữ, số, _ và -): không cho phép ký tự có thể bị hiểu thành tham số khác
+EMOTION_NAME = re.compile(r"^[\w-]+$")
 
 
 @dataclass
@@ -13,10 +20,23 @@ class Narrator(object):
     emotions: tuple[str, ...]
 
 
+@dataclass
+class MatrixCell(object):
+    index: int
+    narrator: str
+    emotions: dict[str, int] | None
+    speed: int | None
+    pitch: int | None
+    output_path: str
+    error: str | None = None
+    audition_start_ms: int | None = None
+    audition_end_ms: int | None = None
+
+
 class Voicepeak:
     def __init__(
         self,
-        exe_path: str = os.path.join(os.environ["ProgramFiles"], "VOICEPEAK", "voicepeak.exe"),
+        exe_path: str = os.path.join(os.environ.get("ProgramFiles", ""), "VOICEPEAK", "voicepeak.exe"),
     ):
         """
         Nếu bạn cài đặt VOICEPEAK ở vị trí không phải mặc định, hãy chỉ định exe_path.
@@ -29,9 +49,12 @@ class Voicepeak:
             raise FileNotFoundError("Không tìm thấy file thực thi VOICEPEAK")
         self.__exe_path = exe_path
 
-    async def __async_run(self, cmd: str) -> str:
-        proc = await asyncio.create_subprocess_shell(
-            f'"{self.__exe_path}" {cmd}',
+    async def __async_run(self, args: list[str]) -> str:
+        # Truyền tham số trực tiếp cho tiến trình (không qua shell) nên text, tên narrator, cảm xúc
+        # không thể bị hiểu thành lệnh shell
+        proc = await asyncio.create_subprocess_exec(
+            self.__exe_path,
+            *args,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
         )
@@ -53,38 +76,47 @@ class Voicepeak:
         emotions: dict[str, int] | None = None,
         speed: int | None = None,
         pitch: int | None = None,
-    ) -> str:
+    ) -> list[str]:
         command = list()
 
         match text, text_file:
             case str(), str():
                 raise ValueError("Chỉ được chỉ định một trong hai: text hoặc text_file")
             case str(), None:
-                command.append(f'-s "{text}"')
+                command += ["-s", text]
             case None, str():
-                command.append(f'-t "{text_file}"')
+                command += ["-t", text_file]
             case None, None:
                 raise ValueError("Cần thiết lập text hoặc text_file.")
             case _:
                 raise ValueError("Giá trị text hoặc text_file không hợp lệ.")
 
         if output_path is not None:
-            command.append(f'-o "{output_path}"')
+            command += ["-o", output_path]
 
         match narrator:
             case Narrator():
-                command.append(f'-n "{narrator.name}"')
+                command += ["-n", narrator.name]
             case str():
-                command.append(f'-n "{narrator}"')
+                command += ["-n", narrator]
             case None:
                 pass
+            case _:
+                raise ValueError("narrator phải là Narrator hoặc str")
 
         if emotions is not None:
-            command.append(f'-e {" ,".join(f"{param}={value}" for param, value in emotions.items())}')
+            if not isinstance(emotions, dict):
+                raise ValueError("emotions phải là dict {tên cảm xúc: giá trị}")
+            for param, value in emotions.items():
+                if not isinstance(param, str) or not EMOTION_NAME.match(param):
+                    raise ValueError(f"Tên cảm xúc không hợp lệ: {param!r}")
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise ValueError(f"Giá trị cảm xúc {param} phải là số nguyên")
+            command += ["-e", ",".join(f"{param}={value}" for param, value in emotions.items())]
 
         SPEED_RANGE = (50, 200)
         if isinstance(speed, int) and (SPEED_RANGE[0] <= speed <= SPEED_RANGE[1]):
-            command.append(f"--speed {speed}")
+            command += ["--speed", str(speed)]
         elif speed is None:
             pass
         else:
@@ -92,13 +124,13 @@ class Voicepeak:
 
         PITCH_RANGE = (-300, 300)
         if isinstance(pitch, int) and (PITCH_RANGE[0] <= pitch <= PITCH_RANGE[1]):
-            command.append(f"--pitch {pitch}")
+            command += ["--pitch", str(pitch)]
         elif pitch is None:
             pass
         else:
             raise ValueError(f"pitch phải là số nguyên trong khoảng {PITCH_RANGE[0]} - {PITCH_RANGE[1]}")
 
-        return " ".join(command)
+        return command
 
     async def say_text(
         self,
@@ -195,7 +227,7 @@ class Voicepeak:
         Trả về:
             tuple[str]: Danh sách tên narrator
         """
-        return tuple(tmp for tmp in (await self.__async_run("--list-narrator")).splitlines())
+        return tuple(tmp for tmp in (await self.__async_run(["--list-narrator"])).splitlines())
 
     async def get_emotion_list(self, name: str) -> tuple[str, ...]:
         """
@@ -207,4 +239,88 @@ class Voicepeak:
         Trả về:
             tuple[str]: Danh sách tên cảm xúc của narrator
         """
-        return tuple(tmp for tmp in (await self.__async_run(f'--list-emotion "{name}"')).splitlines())
+        return tuple(tmp for tmp in (await self.__async_run(["--list-emotion", name])).splitlines())
+
+    async def render_matrix(
+        self,
+        text: str,
+        output_dir: str,
+        *,
+        narrators: list[Narrator | str],
+        emotions: list[dict[str, int] | None] | None = None,
+        speeds: list[int | None] | None = None,
+        pitches: list[int | None] | None = None,
+        concurrency: int = 4,
+        semaphore: asyncio.Semaphore | None = None,
+        audition_path: str | None = None,
+        pause_ms: int = 500,
+    ) -> tuple[MatrixCell, ...]:
+        """
+        Đọc cùng một văn bản với mọi tổ hợp narrator × cảm xúc × tốc độ × cao độ, chạy song song có giới hạn.
+
+        Tham số:
+            text (str): Văn bản cần đọc
+
+            output_dir (str): Thư mục lưu file wav. Mỗi tổ hợp được lưu thành 000.wav, 001.wav, ... theo index.
+
+            narrators (list[Narrator | str]): Danh sách narrator.
+
+            emotions (list[dict[str, int] | None] | None, optional): Danh sách bộ cảm xúc. None trong list là không chỉ định. Mặc định: [None].
+
+            speeds (list[int | None] | None, optional): Danh sách tốc độ đọc. Mặc định: [None].
+
+            pitches (list[int | None] | None, optional): Danh sách cao độ. Mặc định: [None].
+
+            concurrency (int, optional): Số tiến trình VOICEPEAK chạy cùng lúc. Mặc định: 4.
+
+            semaphore (asyncio.Semaphore | None, optional): Giới hạn dùng chung giữa nhiều lần gọi (ví dụ nhiều request
+                cùng lúc). Nếu chỉ định thì concurrency bị bỏ qua. Mặc định: None.
+
+            audition_path (str | None, optional): Nếu chỉ định, nối các file đọc thành công thành một file để nghe thử. Mặc định: None.
+
+            pause_ms (int, optional): Khoảng nghỉ giữa các tổ hợp trong file nghe thử. Mặc định: 500.
+
+        Trả về:
+            tuple[MatrixCell]: Kết quả theo index. Tổ hợp bị lỗi có error khác None, không làm dừng các tổ hợp khác.
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency phải lớn hơn hoặc bằng 1")
+
+        cells = list()
+        commands = list()
+        grid = itertools.product(narrators, emotions or [None], speeds or [None], pitches or [None])
+        for index, (narrator, emotion, speed, pitch) in enumerate(grid):
+            output_path = os.path.join(output_dir, f"{index:03d}.wav")
+            # Kiểm tra tham số của cả lưới trước khi chạy tiến trình nào
+            commands.append(
+                self.__make_say_command(
+                    text=text, output_path=output_path, narrator=narrator, emotions=emotion, speed=speed, pitch=pitch
+                )
+            )
+            name = narrator.name if isinstance(narrator, Narrator) else narrator
+            cells.append(MatrixCell(index, name, emotion, speed, pitch, output_path))
+
+        os.makedirs(output_dir, exist_ok=True)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(concurrency)
+
+        async def render(cell: MatrixCell, command: list[str]):
+            async with semaphore:
+                try:
+                    await self.__async_run(command)
+                except RuntimeError as e:
+                    cell.error = str(e)
+
+        await asyncio.gather(*(render(cell, command) for cell, command in zip(cells, commands)))
+
+        if audition_path is not None:
+            rendered = [cell for cell in cells if cell.error is None]
+            if len(rendered) != 0:
+                spans = await asyncio.to_thread(
+                    concat_wav, [cell.output_path for cell in rendered], audition_path, pause_ms
+                )
+                for cell, (start, end) in zip(rendered, spans):
+                    cell.audition_start_ms = start
+                    cell.audition_end_ms = end
+
+        return tuple(cells)